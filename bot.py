@@ -1,13 +1,21 @@
 import config
 import logging
-import jdatetime
+import math
+from bisect import bisect_left
+from bson import ObjectId
+from bson.errors import InvalidId
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CallbackQueryHandler, ContextTypes, CommandHandler, MessageHandler, filters, ConversationHandler
+from charts import TIMEFRAMES
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, ContextTypes, CommandHandler, MessageHandler, TypeHandler, filters, ConversationHandler
 
 logger = logging.getLogger(__name__)
 
 class Bot:
-    def __init__(self):
+    def __init__(self, admin_ids=None):
+        # Telegram user IDs allowed to use the admin commands (e.g. /profile).
+        self.admin_ids = set(admin_ids or [])
+        # Number of alerts/subscriptions shown per page in the management menus.
+        self.PAGE_SIZE = 8
         self.FREQUENCY_MAP = {
         "daily": "روزانه",
         "weekly": "هفتگی",
@@ -29,8 +37,15 @@ class Bot:
             # States for the "Subscription" flow
             self.GETTING_SUB_CURRENCY,   # Waiting for currency name for a new subscription
             self.GETTING_SUB_FREQUENCY,  # Waiting for the frequency (daily/weekly)
-            self.MANAGING_SUBSCRIPTIONS  # Managing existing subscriptions
-        ) = range(10)
+            self.MANAGING_SUBSCRIPTIONS, # Managing existing subscriptions
+
+            # States for the "Portfolio" flow
+            self.MANAGING_PORTFOLIO,                 # Portfolio menu (holdings/value/alert)
+            self.GETTING_HOLDING_CURRENCY,           # Waiting for currency name for a holding
+            self.GETTING_HOLDING_AMOUNT,             # Waiting for the amount held
+            self.GETTING_PORTFOLIO_ALERT_CONDITION,  # Select portfolio alert condition (value increase/decrease)
+            self.GETTING_PORTFOLIO_ALERT_VALUE       # Waiting for the target portfolio value
+        ) = range(15)
         
         # --- Conversation Handler ---
         self.conv_handler = ConversationHandler(
@@ -45,6 +60,7 @@ class Bot:
                     CallbackQueryHandler(self.live_price_flow_start, pattern='^live_price$'),
                     CallbackQueryHandler(self.price_alert_flow_start, pattern='^price_alert$'),
                     CallbackQueryHandler(self.price_subscription_flow_start, pattern='^price_subscription$'),
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio$'),
                 ],
                 
                 # States for the "Live Price" Flow
@@ -53,6 +69,7 @@ class Bot:
                 ],
                 self.AFTER_PRICE_RESULT: [
                 CallbackQueryHandler(self.live_price_check_another, pattern='^live_price_again$'),
+                CallbackQueryHandler(self.live_price_chart, pattern='^chart_'),
                 CallbackQueryHandler(self.live_price_back_to_menu, pattern='^main_menu$'),
                 ],
 
@@ -76,6 +93,9 @@ class Bot:
                     # Handler for "Cancel" buttons
                     # Pattern looks for anything that starts with "cancel_alert_"
                     CallbackQueryHandler(self.cancel_alert, pattern='^cancel_alert_'),
+
+                    # Handler for the page navigation buttons
+                    CallbackQueryHandler(self.price_alert_flow_start, pattern='^alert_page_'),
                     
                     # Handler for the return to main menu button
                     CallbackQueryHandler(self.start_command, pattern='^main_menu$')
@@ -95,9 +115,37 @@ class Bot:
                 # Handler for "Unsubscribe" buttons
                 # Pattern looks for anything that starts with "cancel_sub_"
                 CallbackQueryHandler(self.cancel_subscription, pattern='^cancel_sub_'),
+
+                # Handler for the page navigation buttons
+                CallbackQueryHandler(self.price_subscription_flow_start, pattern='^sub_page_'),
                 
                 # Handler for the return to main menu button
                 CallbackQueryHandler(self.start_command, pattern='^main_menu$')
+                ],
+                # States for the "Portfolio" Flow
+                self.MANAGING_PORTFOLIO: [
+                    CallbackQueryHandler(self.start_new_holding_flow, pattern='^new_holding$'),
+                    CallbackQueryHandler(self.cancel_holding, pattern='^cancel_holding_'),
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio_page_'),
+                    CallbackQueryHandler(self.portfolio_alert_start, pattern='^portfolio_alert$'),
+                    CallbackQueryHandler(self.cancel_portfolio_alert, pattern='^cancel_portfolio_alert$'),
+                    CallbackQueryHandler(self.start_command, pattern='^main_menu$')
+                ],
+                self.GETTING_HOLDING_CURRENCY: [
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio$'),
+                    MessageHandler(filters.TEXT & (~filters.COMMAND), self.portfolio_get_currency)
+                ],
+                self.GETTING_HOLDING_AMOUNT: [
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio$'),
+                    MessageHandler(filters.TEXT & (~filters.COMMAND), self.portfolio_get_amount)
+                ],
+                self.GETTING_PORTFOLIO_ALERT_CONDITION: [
+                    CallbackQueryHandler(self.portfolio_alert_get_condition, pattern='^(gte|lte)$'),
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio$'),
+                ],
+                self.GETTING_PORTFOLIO_ALERT_VALUE: [
+                    CallbackQueryHandler(self.portfolio_flow_start, pattern='^portfolio$'),
+                    MessageHandler(filters.TEXT & (~filters.COMMAND), self.portfolio_alert_get_value)
                 ]
             },
             
@@ -115,7 +163,49 @@ class Bot:
     # We also need a method to return the handler to main.py
     def get_conv_handler(self):
         return self.conv_handler
+
+    def get_activity_handler(self):
+        """Sees every update before the other handlers (register it in group -1), for the active-users count."""
+        # block=False: the other handlers never wait for this write.
+        return TypeHandler(Update, self.record_activity, block=False)
+
+    async def record_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user is not None:
+            await context.application.db_manager.record_activity(update.effective_user.id)
+
+    def get_admin_handlers(self):
+        """Admin-only commands, registered outside the main conversation."""
+        return [
+            CommandHandler('profile', self.profile_command),
+            CommandHandler('stats', self.stats_command)
+        ]
     
+    def paginate(self, items, query, prefix, parse_cursor=ObjectId):
+        """
+        Returns the page of items (sorted by _id) to show, plus the navigation buttons row.
+        The page cursor is the _id of its first item, carried in the callback data as "<prefix><_id>"
+        (parse_cursor turns it back into an _id). If that item was deleted meanwhile, the page starts at the next one.
+        """
+        start = 0
+        if query and query.data.startswith(prefix):
+            try:
+                cursor = parse_cursor(query.data[len(prefix):])
+                start = bisect_left([item['_id'] for item in items], cursor)
+            except InvalidId:
+                pass
+        # Never show an empty page (e.g. after deleting the only item on the last page).
+        if start >= len(items):
+            start = max(0, (len(items) - 1) // self.PAGE_SIZE * self.PAGE_SIZE)
+
+        page = items[start:start + self.PAGE_SIZE]
+        navigation = []
+        if start > 0:
+            previous_start = max(0, start - self.PAGE_SIZE)
+            navigation.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"{prefix}{items[previous_start]['_id']}"))
+        if start + self.PAGE_SIZE < len(items):
+            navigation.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"{prefix}{items[start + self.PAGE_SIZE]['_id']}"))
+        return page, navigation
+
     """---------- Start Handler ----------"""
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         message = """
@@ -125,17 +215,19 @@ class Bot:
     - نمایش قیمت لحظه‌ای ارز دیجیتال.
     - اعلام قیمت به‌صورت دوره‌ای (روزانه، هفتگی، ماهانه).
     - ایجاد هشدار قیمت.
+    - پیگیری ارزش پرتفوی.
 
     برای شروع، یکی از گزینه‌های زیر را انتخاب کنید:
     """
 
         user = update.effective_user
-        logger.info("User %s (%s) started the conversation.", user.first_name, user.id)
+        logger.info("User %s (%s) started the conversation.", user.first_name, user.id, extra={"hot_path": True})
 
         keyboard = [
             [InlineKeyboardButton("📈 قیمت لحظه‌ای ارز دیجیتال", callback_data="live_price")],
             [InlineKeyboardButton("🔔 اعلام قیمت به‌صورت دوره‌ای", callback_data="price_subscription")],
-            [InlineKeyboardButton("🎯 ایجاد هشدار قیمت", callback_data="price_alert")]
+            [InlineKeyboardButton("🎯 ایجاد هشدار قیمت", callback_data="price_alert")],
+            [InlineKeyboardButton("💼 پرتفوی من", callback_data="portfolio")]
         ]
 
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -171,8 +263,11 @@ class Bot:
         user_input = update.message.text
         db_manager = context.application.db_manager
         currency_data = await db_manager.get_currency_info(user_input)
+        db_manager.stats.record_query(currency_data['symbol'] if currency_data else None)
 
         if currency_data:
+            # Imported here to keep it off the startup path.
+            import jdatetime
             utc_last_update = currency_data['last_update']
             jalali_time = jdatetime.datetime.fromgregorian(datetime=utc_last_update)
             formatted_jalali_time = jalali_time.strftime('%Y/%m/%d - ساعت %H:%M')
@@ -185,7 +280,12 @@ class Bot:
             response_message += f"حجم معاملات در ۲۴ ساعت گذشته: {currency_data['volume_24h']}\n"
             response_message += f"آخرین به‌روزرسانی: {formatted_jalali_time}\n"
         
+            chart_buttons = [
+                InlineKeyboardButton(f"📊 {label}", callback_data=f"chart_{currency_data['_id']}_{timeframe}")
+                for timeframe, (_, label) in TIMEFRAMES.items()
+            ]
             keyboard = [
+                chart_buttons,
                 [InlineKeyboardButton("🔍 بررسی یک ارز دیگر", callback_data="live_price_again")],
                 [InlineKeyboardButton("⬅️ بازگشت به منوی اصلی", callback_data="main_menu")],
             ]
@@ -199,6 +299,33 @@ class Bot:
             await update.message.reply_text(response_message)
             return self.GETTING_LIVE_PRICE
     
+    async def live_price_chart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Sends the price chart for the chosen timeframe, keeping the price result and its buttons."""
+        query = update.callback_query
+        # The callback_data looks like this: "chart_BTCTMN_7d"
+        symbol, timeframe = query.data.replace('chart_', '', 1).rsplit('_', 1)
+        if timeframe not in TIMEFRAMES:
+            await query.answer()
+            return self.AFTER_PRICE_RESULT
+
+        charts = context.application.bot_data['charts']
+        caption = f"نمودار قیمت {symbol} در {TIMEFRAMES[timeframe][1]} گذشته"
+        try:
+            message = await charts.send_chart(
+                symbol,
+                timeframe,
+                lambda photo: query.message.reply_photo(photo=photo, caption=caption)
+            )
+        except Exception as e:
+            logger.error(f"Failed to send chart {symbol}/{timeframe}: {e}")
+            message = None
+
+        if message is None:
+            await query.answer("متاسفانه هنوز داده‌ی کافی برای رسم نمودار این ارز وجود ندارد.", show_alert=True)
+        else:
+            await query.answer()
+        return self.AFTER_PRICE_RESULT
+
     async def live_price_check_another(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """After displaying the price, it requests the next currency by sending a new message."""
         query = update.callback_query
@@ -230,13 +357,15 @@ class Bot:
     - نمایش قیمت لحظه‌ای ارز دیجیتال.
     - اعلام قیمت به‌صورت دوره‌ای (روزانه، هفتگی، ماهانه).
     - ایجاد هشدار قیمت.
+    - پیگیری ارزش پرتفوی.
 
     برای شروع، یکی از گزینه‌های زیر را انتخاب کنید:
     """
         keyboard = [
             [InlineKeyboardButton("📈 قیمت لحظه‌ای ارز دیجیتال", callback_data="live_price")],
             [InlineKeyboardButton("🔔 اعلام قیمت به‌صورت دوره‌ای", callback_data="price_subscription")],
-            [InlineKeyboardButton("🎯 ایجاد هشدار قیمت", callback_data="price_alert")]
+            [InlineKeyboardButton("🎯 ایجاد هشدار قیمت", callback_data="price_alert")],
+            [InlineKeyboardButton("💼 پرتفوی من", callback_data="portfolio")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -256,11 +385,14 @@ class Bot:
 
         if subscriptions:
             message = "شما اشتراک‌های زیر را دارید. می‌توانید آنها را لغو کنید یا اشتراک جدیدی اضافه کنید."
+            page, navigation = self.paginate(subscriptions, query, "sub_page_")
             keyboard = []
-            for sub in subscriptions:
+            for sub in page:
                 button_text = f"🗑️ لغو {sub['symbol']} ({self.FREQUENCY_MAP[sub['frequency']]})"
                 callback_data = f"cancel_sub_{sub['_id']}" # Use the unique DB ID
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+            if navigation:
+                keyboard.append(navigation)
 
             keyboard.append([InlineKeyboardButton("➕ افزدون اشتراک جدید", callback_data="new_sub")])
             keyboard.append([InlineKeyboardButton("⬅️ بازگشت به منو", callback_data="main_menu")])
@@ -284,6 +416,7 @@ class Bot:
         user_input = update.message.text
         db_manager = context.application.db_manager
         currency_data = await db_manager.get_currency_info(user_input)
+        db_manager.stats.record_query(currency_data['symbol'] if currency_data else None)
 
         if currency_data:
             context.user_data['sub_currency'] = user_input
@@ -380,13 +513,16 @@ class Bot:
         check_subs = await db_manager.get_user_price_alert(user_id)
         if check_subs:
             message = "شما اعلان‌های زیر را دارید. می‌توانید آنها را لغو کنید یا اشتراک جدیدی اضافه کنید."
+            page, navigation = self.paginate(check_subs, query, "alert_page_")
             keyboard = []
-            for sub in check_subs:
+            for sub in page:
                 button_text = ""
                 callback_data = ""
                 button_text = f"🗑️ لغو {sub['symbol']} با قیمت ({sub['target_price']})"
                 callback_data = f"cancel_alert_{sub['_id']}" # Use the unique DB ID
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+            if navigation:
+                keyboard.append(navigation)
             keyboard.append([InlineKeyboardButton("➕ افزدون اعلان جدید", callback_data="new_alert")])
             keyboard.append([InlineKeyboardButton("⬅️ بازگشت به منو", callback_data="main_menu")])
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -413,6 +549,7 @@ class Bot:
         user_input = update.message.text
         db_manager = context.application.db_manager
         check_existence = await db_manager.get_currency_info(user_input)
+        db_manager.stats.record_query(check_existence['symbol'] if check_existence else None)
         if check_existence:
             context.user_data['alert_currency'] = check_existence['symbol']
             message = f"عالی! برای ارز «{check_existence['fa_symbol']}» می‌خواهید در چه حالتی به شما اطلاع داده شود؟"
@@ -529,16 +666,251 @@ class Bot:
             await query.edit_message_text("خطایی در حذف اشتراک رخ داد. لطفاً دوباره تلاش کنید.")
             return self.MANAGING_ALERTS
 
+    """---------- Service 4 : Portfolio ----------"""
+    async def portfolio_flow_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, send_new_message: bool = False):
+        """Handles the 'Portfolio' button press: shows holdings, total value and the value alert."""
+        query = update.callback_query
+        if query:
+            await query.answer()
+
+        user_id = update.effective_user.id
+        db_manager = context.application.db_manager
+        # Served from memory: no database round trip.
+        holdings, total_value, value_alert = db_manager.get_user_portfolio(user_id)
+
+        keyboard = []
+        if holdings:
+            message = f"ارزش کل پرتفوی شما: {total_value:,.0f} تومان\n"
+            items = [{"_id": symbol, "amount": amount} for symbol, amount in sorted(holdings.items())]
+            page, navigation = self.paginate(items, query, "portfolio_page_", parse_cursor=str)
+            for item in page:
+                keyboard.append([InlineKeyboardButton(f"🗑️ حذف {item['_id']} ({item['amount']:g})", callback_data=f"cancel_holding_{item['_id']}")])
+            if navigation:
+                keyboard.append(navigation)
+            if value_alert:
+                direction = "بیشتر" if value_alert['condition'] == "gte" else "کمتر"
+                message += f"هشدار فعال: ارزش {direction} از {value_alert['target_value']:,.0f} تومان"
+                keyboard.append([InlineKeyboardButton("🗑️ لغو هشدار ارزش پرتفوی", callback_data="cancel_portfolio_alert")])
+            else:
+                keyboard.append([InlineKeyboardButton("🎯 هشدار ارزش پرتفوی", callback_data="portfolio_alert")])
+        else:
+            message = "پرتفوی شما خالی است. برای شروع یک دارایی اضافه کنید."
+        keyboard.append([InlineKeyboardButton("➕ افزودن دارایی", callback_data="new_holding")])
+        keyboard.append([InlineKeyboardButton("⬅️ بازگشت به منو", callback_data="main_menu")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        # Edit the message if it came from a button.
+        if query and not send_new_message:
+            await query.edit_message_text(text=message, reply_markup=reply_markup)
+        # Otherwise (e.g. after adding a holding), send a new message.
+        else:
+            await context.bot.send_message(chat_id=user_id, text=message, reply_markup=reply_markup)
+
+        return self.MANAGING_PORTFOLIO
+
+    async def start_new_holding_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+
+        message = "لطفاً نام ارز مورد نظر را برای افزودن به پرتفوی وارد کنید:"
+        keyboard = [
+            [InlineKeyboardButton("⬅️ بازگشت", callback_data="portfolio")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(text=message, reply_markup=reply_markup)
+
+        return self.GETTING_HOLDING_CURRENCY
+
+    async def portfolio_get_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_input = update.message.text
+        db_manager = context.application.db_manager
+        currency_data = await db_manager.get_currency_info(user_input)
+        db_manager.stats.record_query(currency_data['symbol'] if currency_data else None)
+
+        if currency_data:
+            # Holdings are valued in Toman, so prefer the currency's Toman market.
+            context.user_data['holding_symbol'] = db_manager.snapshot.toman_market(currency_data)
+            message = f"چه مقدار «{currency_data['fa_symbol']}» دارید؟"
+            keyboard = [
+                [InlineKeyboardButton("⬅️ بازگشت", callback_data="portfolio")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(message, reply_markup=reply_markup)
+            return self.GETTING_HOLDING_AMOUNT
+        else:
+            response_message = f"متاسفانه واحد پول '{user_input}' پیدا نشد. لطفا دوباره امتحان کنید."
+            await update.message.reply_text(response_message)
+            return self.GETTING_HOLDING_CURRENCY
+
+    async def portfolio_get_amount(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chosen_symbol = context.user_data.get('holding_symbol')
+        user_id = update.effective_user.id
+
+        try:
+            amount = float(update.message.text)
+            # float() also accepts "nan" and "inf", which would break the portfolio's value.
+            if not math.isfinite(amount) or amount <= 0:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("لطفاً یک عدد مثبت وارد کنید.")
+            # Stay in the same state to let them try again
+            return self.GETTING_HOLDING_AMOUNT
+
+        if not chosen_symbol:
+            await update.message.reply_text("خطایی رخ داده. لطفا دوباره بات را /start کنید.")
+            return ConversationHandler.END
+
+        db_manager = context.application.db_manager
+        await db_manager.add_or_update_holding(user_id=user_id, symbol=chosen_symbol, amount=amount)
+        context.user_data.pop('holding_symbol', None)
+
+        await update.message.reply_text(f"دارایی {chosen_symbol} به مقدار {amount:g} در پرتفوی شما ثبت شد.")
+        return await self.portfolio_flow_start(update, context, send_new_message=True)
+
+    async def cancel_holding(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+
+        # The callback_data looks like this: "cancel_holding_BTCTMN"
+        symbol = query.data.replace('cancel_holding_', '')
+        db_manager = context.application.db_manager
+        success = await db_manager.delete_holding(update.effective_user.id, symbol)
+
+        if success:
+            return await self.portfolio_flow_start(update, context)
+        else:
+            await query.edit_message_text("خطایی در حذف دارایی رخ داد. لطفاً دوباره تلاش کنید.")
+            return self.MANAGING_PORTFOLIO
+
+    async def portfolio_alert_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+
+        message = "می‌خواهید در چه حالتی از ارزش پرتفوی خود مطلع شوید؟"
+        keyboard = [
+            [
+                InlineKeyboardButton("📈 افزایش ارزش به", callback_data="gte"),
+                InlineKeyboardButton("📉 کاهش ارزش به", callback_data="lte")
+            ],
+            [InlineKeyboardButton("⬅️ بازگشت", callback_data="portfolio")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(text=message, reply_markup=reply_markup)
+
+        return self.GETTING_PORTFOLIO_ALERT_CONDITION
+
+    async def portfolio_alert_get_condition(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+
+        # Storing the selected condition ("gte" or "lte") in memory.
+        context.user_data['portfolio_alert_condition'] = query.data
+
+        message = "بسیار خب، لطفاً ارزش هدف پرتفوی را (به تومان) وارد کنید:"
+        keyboard = [
+            [InlineKeyboardButton("⬅️ بازگشت", callback_data="portfolio")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(text=message, reply_markup=reply_markup)
+
+        return self.GETTING_PORTFOLIO_ALERT_VALUE
+
+    async def portfolio_alert_get_value(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chosen_condition = context.user_data.get('portfolio_alert_condition')
+        user_id = update.effective_user.id
+
+        try:
+            target_value = float(update.message.text)
+            if not math.isfinite(target_value) or target_value <= 0:
+                raise ValueError
+        except ValueError:
+            await update.message.reply_text("لطفا برای اطلاع از ارزش پرتفوی، عدد صحیح را وارد کنید.")
+            # Stay in the same state to let them try again
+            return self.GETTING_PORTFOLIO_ALERT_VALUE
+
+        if not chosen_condition:
+            await update.message.reply_text("خطایی رخ داده. لطفا دوباره بات را /start کنید.")
+            return ConversationHandler.END
+
+        db_manager = context.application.db_manager
+        await db_manager.set_portfolio_alert(user_id=user_id, target_value=target_value, condition=chosen_condition)
+        context.user_data.pop('portfolio_alert_condition', None)
+
+        await update.message.reply_text(f"هشدار ارزش پرتفوی ثبت شد. به محض رسیدن به {target_value:,.0f} تومان اطلاع داده خواهد شد.")
+        return await self.portfolio_flow_start(update, context, send_new_message=True)
+
+    async def cancel_portfolio_alert(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+
+        db_manager = context.application.db_manager
+        await db_manager.delete_portfolio_alert(update.effective_user.id)
+        return await self.portfolio_flow_start(update, context)
+
     async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancels and ends the conversation."""
         user = update.effective_user
-        logger.info("User %s canceled the conversation.", user.first_name)
+        logger.info("User %s canceled the conversation.", user.first_name, extra={"hot_path": True})
         await update.message.reply_text(
             'باشه! هر وقت آماده بودی، دوباره با /start شروع کن.'
         )
         # Ending the conversation
         return ConversationHandler.END
 
+    """---------- Admin Commands ----------"""
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Starts the sampling profiler for N seconds: /profile [seconds]"""
+        user = update.effective_user
+        if user.id not in self.admin_ids:
+            logger.warning("User %s (%s) tried to use /profile without permission.", user.first_name, user.id)
+            return
+
+        try:
+            duration = float(context.args[0]) if context.args else 30.0
+        except ValueError:
+            await update.message.reply_text("Usage: /profile [seconds]")
+            return
+        duration = max(1.0, min(duration, 600.0))
+
+        profiler = context.application.bot_data['profiler']
+        output_path = profiler.start(duration)
+        if output_path is None:
+            await update.message.reply_text("A profiling session is already running.")
+        else:
+            await update.message.reply_text(f"Profiling for {duration:g}s. Output: {output_path}")
+
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Shows the usage statistics: /stats"""
+        user = update.effective_user
+        if user.id not in self.admin_ids:
+            logger.warning("User %s (%s) tried to use /stats without permission.", user.first_name, user.id)
+            return
+
+        stats = await context.application.db_manager.get_stats()
+        totals, today = stats["totals"], stats["today"]
+
+        def top(counts, n=10):
+            ranked = sorted(((name, count) for name, count in counts.items() if count > 0), key=lambda item: -item[1])
+            return ", ".join(f"{name}: {count}" for name, count in ranked[:n]) or "-"
+
+        alerts = totals.get("alerts", {})
+        lines = [
+            f"Users: {totals.get('users', 0)} (blocked: {totals.get('blocked_users', 0)})",
+            f"Today: {today.get('active_users', 0)} active, {today.get('new_users', 0)} new",
+            f"Active alerts: {sum(alerts.values())}",
+            f"Top alert symbols: {top(alerts)}",
+            f"Alerts triggered: {totals.get('alerts_triggered', 0)} (today: {today.get('alerts_triggered', 0)})",
+            f"Subscriptions: {top(totals.get('subscriptions', {}))}",
+            f"Portfolios: {totals.get('portfolios', 0)} (value alerts: {totals.get('portfolio_alerts', 0)})",
+            f"Top queries: {top(totals.get('queries', {}))}",
+            f"Top queries today: {top(today.get('queries', {}))}",
+            f"Queries not found: {totals.get('queries_missed', 0)} (today: {today.get('queries_missed', 0)})"
+        ]
+        rejections = getattr(context.application.update_processor, "rejections", None)
+        if rejections is not None:
+            lines.append(f"Throttled updates: {top(rejections)}")
+        await update.message.reply_text("\n".join(lines))
+
     async def run_async(self):
         """Configures handlers and starts bot polling."""
         logger.info("Configuring bot handlers...")
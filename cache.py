@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+class UserCache:
+    """
+    Small LRU read-through cache of per-user data (e.g. a user's alerts).
+    Entries are filled on read and dropped by invalidate() whenever that user's data is written.
+    It also remembers when each user last wrote, so reads right after a write can go to the primary.
+    """
+    def __init__(self, max_users: int = 10000):
+        self.max_users = max_users
+        self.entries = OrderedDict()
+        self.written_at = OrderedDict()  # user_id -> monotonic time of the last write, oldest first
+        # user_id -> token of the load in progress. invalidate() removes it, so a load that
+        # raced with a write does not put stale data back in the cache.
+        self.loading = {}
+
+    async def get_or_load(self, user_id, loader):
+        if user_id in self.entries:
+            self.entries.move_to_end(user_id)
+            return self.entries[user_id]
+
+        token = object()
+        self.loading[user_id] = token
+        try:
+            value = await loader()
+        finally:
+            still_valid = self.loading.get(user_id) is token
+            if still_valid:
+                del self.loading[user_id]
+
+        if still_valid:
+            self.entries[user_id] = value
+            if len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id):
+        self.entries.pop(user_id, None)
+        self.loading.pop(user_id, None)
+        self.written_at.pop(user_id, None)
+        self.written_at[user_id] = time.monotonic()
+        if len(self.written_at) > self.max_users:
+            self.written_at.popitem(last=False)
+
+    def written_within(self, user_id, seconds: float):
+        """True if the user's data was written in the last `seconds` seconds."""
+        written_at = self.written_at.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < seconds
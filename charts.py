@@ -0,0 +1,117 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Timeframe code (used in callback data) -> (history length, Persian label)
+TIMEFRAMES = {
+    "1d": (timedelta(days=1), "۲۴ ساعت"),
+    "7d": (timedelta(days=7), "۷ روز"),
+    "30d": (timedelta(days=30), "۳۰ روز")
+}
+
+def render_chart(title: str, times: list, prices: list):
+    """Draws a price line chart and returns it as PNG bytes. Runs in a worker process."""
+    # Imported here so only the worker processes pay for loading matplotlib.
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    fig = Figure(figsize=(8, 4), dpi=100)
+    ax = fig.subplots()
+    ax.plot(times, prices, linewidth=1.5)
+    ax.set_title(title)
+    ax.grid(True, alpha=0.3)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax.xaxis.get_major_locator()))
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartEntry:
+    __slots__ = ("version", "render", "file_id", "upload_lock")
+
+    def __init__(self, version, render):
+        self.version = version
+        self.render = render          # Future with the PNG bytes (or None if there is no history)
+        self.file_id = None           # Telegram file_id after the first upload
+        self.upload_lock = asyncio.Lock()
+
+
+class ChartService:
+    """
+    Renders price charts from the stored history and caches them per (symbol, timeframe).
+    A cached chart is valid until the market's price changes (its last_update in the snapshot),
+    so a popular chart is rendered once per update and uploaded to Telegram once; everyone
+    else gets it by file_id.
+    """
+    def __init__(self, db_manager, max_workers: int = 2, max_entries: int = 256):
+        self.db_manager = db_manager
+        self.max_entries = max_entries
+        # Not "fork": the bot already runs threads (log listener, to_thread workers) whose locks a forked child
+        # could inherit held. The fork server is a fresh interpreter; with nothing preloaded it stays single-threaded.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([])
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        self.entries = OrderedDict()  # (symbol, timeframe) -> ChartEntry
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_entry(self, symbol, timeframe):
+        market = self.db_manager.snapshot.markets.get(symbol)
+        version = market["last_update"] if market else None
+        key = (symbol, timeframe)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry.version == version:
+            self.entries.move_to_end(key)
+            return entry
+
+        # First request for this chart since the last price change: render it (once, shared by all callers).
+        entry = ChartEntry(version, asyncio.ensure_future(self._render(symbol, timeframe)))
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def _render(self, symbol, timeframe):
+        period, _ = TIMEFRAMES[timeframe]
+        history = await self.db_manager.get_price_history(symbol, datetime.now(timezone.utc) - period)
+        if len(history) < 2:
+            return None
+        times = [point["time"] for point in history]
+        prices = [point["price"] for point in history]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, render_chart, f"{symbol} - {timeframe}", times, prices)
+
+    async def send_chart(self, symbol, timeframe, send_photo):
+        """
+        Sends the chart with send_photo(photo), an async callable returning the sent Message.
+        Returns the Message, or None if there isn't enough history to draw a chart.
+        """
+        entry = self._get_entry(symbol, timeframe)
+        try:
+            png = await asyncio.shield(entry.render)
+        except Exception:
+            # Don't cache failures; the next request tries again.
+            if self.entries.get((symbol, timeframe)) is entry:
+                del self.entries[(symbol, timeframe)]
+            raise
+        if png is None:
+            return None
+
+        if entry.file_id is None:
+            async with entry.upload_lock:
+                if entry.file_id is None:
+                    message = await send_photo(png)
+                    entry.file_id = message.photo[-1].file_id
+                    return message
+        return await send_photo(entry.file_id)
@@ -1,15 +1,131 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+import time
+from dotenv import load_dotenv
+
+"""---------- Log Handlers ----------"""
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates the log file when it grows past max_bytes or when rotate_seconds have passed, whichever comes first."""
+    def __init__(self, filename, max_bytes, backup_count, rotate_seconds, encoding=None):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = time.time() + rotate_seconds if rotate_seconds else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.rollover_at is not None:
+            self.rollover_at = time.time() + self.rotate_seconds
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class HotPathFilter(logging.Filter):
+    """
+    Rate limits and samples DEBUG/INFO records from hot paths, per call site, before they reach the queue.
+    Only records logged with extra={"hot_path": True} (collector ticks, per-update handlers) are throttled;
+    everything else, and warnings and errors, always pass. When a call site is throttled, the next record
+    that gets through carries a note with the number of suppressed messages.
+    """
+    def __init__(self, max_per_second: float, sample_rate: float):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.sample_rate = sample_rate
+        self.windows = {}  # (pathname, lineno) -> [window_start, count, suppressed]
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not getattr(record, "hot_path", False):
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if not self.max_per_second:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window else 0
+            self.windows[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+            return True
+        if window[1] < self.max_per_second:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
 
 """---------- Logging Config ----------"""
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'), # Handler to write to file
-        logging.StreamHandler(sys.stdout) # Handler for writing to the console
-    ]
-)
-# This section is to reduce additional logs from other libraries.
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("apscheduler").setLevel(logging.WARNING)
\ No newline at end of file
+queue_listener = None
+
+def setup_logging():
+    """
+    Configures logging for the process. Called from main() (not at import time), so processes that
+    only import the bot's modules, like the chart workers, don't open the log file or start threads.
+
+    All records go through a queue; a background thread does the actual (blocking) disk and console I/O,
+    so logging never blocks the event loop.
+    """
+    global queue_listener
+    if queue_listener is not None:
+        return
+    # Make sure .env values are visible here, even if main() hasn't loaded them yet.
+    load_dotenv()
+
+    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    formatter = JsonFormatter() if os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes") else logging.Formatter(log_format)
+
+    file_handler = SizeAndTimeRotatingFileHandler( # Handler to write to file
+        os.getenv("LOG_FILE", "bot.log"),
+        max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+        rotate_seconds=int(os.getenv("LOG_ROTATE_SECONDS", 24 * 60 * 60)),
+        encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler(sys.stdout) # Handler for writing to the console
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The record is formatted once, by the file and console handlers; the queue only passes on the message.
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler.addFilter(HotPathFilter(
+        max_per_second=float(os.getenv("LOG_RATE_LIMIT", 0)),
+        sample_rate=float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+    ))
+    queue_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    queue_listener.start()
+    # Flush whatever is still queued when the process exits.
+    atexit.register(queue_listener.stop)
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        handlers=[queue_handler]
+    )
+    # This section is to reduce additional logs from other libraries.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
@@ -1,23 +1,37 @@
 import config
+import hashlib
 import logging
 import httpx
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timezone
-from telegram.error import Forbidden
+from markets import decode_markets
+from outbox import notification_key
 
 logger = logging.getLogger(__name__)
 
 class Collector:
-    def __init__(self, api_key, db_manager, app):
+    # Telegram rejects messages longer than 4096 characters.
+    MAX_MESSAGE_LENGTH = 4096
+
+    def __init__(self, api_key, db_manager, app, snapshot_path=None, snapshot_interval=5, tape=None, outbox=None,
+                 alerts_per_message=20):
         self.api_key = api_key
         self.db_manager = db_manager
         self.app = app
+        # Outbox that delivers notifications in the background; the collector only enqueues them.
+        self.outbox = outbox
+        # Triggered alerts of one user in one tick are combined into messages of at most this many alerts.
+        self.alerts_per_message = alerts_per_message
+        # Optional TapeWriter that records every raw markets payload for later replay.
+        self.tape = tape
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
         self.scheduler = AsyncIOScheduler()
         logger.info(f"Collector initialized.")
     
     async def get_currency_price(self):
         """Fetches the latest prices from the API, updates the DB, and sends triggered alerts."""
-        logger.info("Task started: Fetching currency prices...")
+        logger.info("Task started: Fetching currency prices...", extra={"hot_path": True})
         headers = {'x-api-key': self.api_key}
         api_url = "https://api.wallex.ir/hector/web/v1/markets"
 
@@ -26,47 +40,128 @@ class Collector:
                 api_response = await client.get(api_url, headers=headers)
             api_response.raise_for_status()
 
-            await self.db_manager.update_prices(api_response.json())
-            logger.info("Data fetched and saved to database successfully.")
-
-            triggered_alerts = await self.db_manager.find_triggered_alerts()
-            for alert in triggered_alerts:
-                try:
-                    message = f"🎯 هشدار قیمت!\n"
-                    message += f"ارز {alert['symbol']} به قیمت هدف شما یعنی {alert['target_price']} رسید."
-                    
-                    await self.app.bot.send_message(chat_id=alert['user_id'], text=message)
-                    
-                    await self.db_manager.update_alert_status(alert['_id'], "triggered")
-                
-                # This error occurs if the user has blocked the bot.
-                except Forbidden:
-                    logger.warning(f"User {alert['user_id']} has blocked the bot. Deactivating their alerts.")
+            if self.tape:
+                await self.tape.append(api_response.content)
 
-                except Exception as e:
-                    logger.error(f"Failed to send alert to user {alert['user_id']}: {e}")
+            await self.process_markets(decode_markets(api_response.content))
 
         except httpx.RequestError as e:
             logger.error(f"Failed to fetch data from API.", exc_info=True)
+
+    async def process_markets(self, markets: list, send_notifications: bool = True):
+        """
+        Updates the DB with one tick of decoded markets and handles the alerts it triggers.
+        Only markets whose values changed are written and checked against alerts.
+        With send_notifications=False (used by replay) alerts are marked as triggered without messaging anyone.
+        Returns the list of triggered alerts.
+        """
+        changed_symbols = await self.db_manager.update_prices(markets)
+        logger.info(f"Data fetched and saved to database successfully ({len(changed_symbols)} of {len(markets)} markets changed).", extra={"hot_path": True})
+
+        triggered_alerts = await self.db_manager.find_triggered_alerts(changed_symbols)
+        # Skip chats we already know are dead, without calling the API.
+        triggered_alerts = [alert for alert in triggered_alerts if not self.db_manager.is_user_blocked(alert['user_id'])]
+        if triggered_alerts:
+            try:
+                if send_notifications:
+                    # Enqueued before the status change: if we crash in between, the alerts trigger
+                    # again, and alerts whose key is already in the outbox are not queued twice.
+                    queued = await self.db_manager.get_queued_alert_keys([self.alert_key(alert) for alert in triggered_alerts])
+                    await self.outbox.enqueue_many(
+                        self.build_alert_messages([alert for alert in triggered_alerts if self.alert_key(alert) not in queued])
+                    )
+
+                await self.db_manager.update_alerts_status(triggered_alerts, "triggered")
+
+            except Exception as e:
+                logger.error(f"Failed to queue {len(triggered_alerts)} triggered alerts: {e}")
+                # Try again on the next tick, even if these prices don't change.
+                self.db_manager.snapshot.recheck_alerts(alert['symbol'] for alert in triggered_alerts)
+
+        if changed_symbols or self.db_manager.portfolio_book.recheck:
+            await self.process_portfolio_alerts(send_notifications)
+
+        return triggered_alerts
+
+    @staticmethod
+    def alert_key(alert):
+        """Idempotency key of a single alert's notification; changes whenever the alert is set again."""
+        return notification_key("alert", alert['_id'], alert.get('last_update'))
+
+    def build_alert_messages(self, alerts):
+        """
+        Groups triggered alerts by user and renders one combined notification per user, split into
+        several messages if the list is long. Returns [(idempotency key, chat_id, text, alert keys)].
+        """
+        alerts_by_user = {}
+        for alert in alerts:
+            alerts_by_user.setdefault(alert['user_id'], []).append(alert)
+
+        messages = []
+        header = "🎯 هشدار قیمت!\n"
+        for user_id, user_alerts in alerts_by_user.items():
+            chunks = [[]]
+            length = len(header)
+            for alert in user_alerts:
+                line = f"ارز {alert['symbol']} به قیمت هدف شما یعنی {alert['target_price']} رسید.\n"
+                if chunks[-1] and (len(chunks[-1]) >= self.alerts_per_message or length + len(line) > self.MAX_MESSAGE_LENGTH):
+                    chunks.append([])
+                    length = len(header)
+                chunks[-1].append((alert, line))
+                length += len(line)
+
+            for chunk in chunks:
+                text = header + "".join(line for _, line in chunk)
+                # Each alert's own key is stored with the message, so an alert is never queued twice
+                # even if a retry groups it differently. The message key only has to be unique.
+                alert_keys = [self.alert_key(alert) for alert, _ in chunk]
+                key = notification_key("alerts", user_id, hashlib.sha1("|".join(alert_keys).encode()).hexdigest())
+                messages.append((key, user_id, text.rstrip("\n"), alert_keys))
+        return messages
+
+    async def process_portfolio_alerts(self, send_notifications: bool = True):
+        """Revalues all portfolios in one pass and notifies users whose portfolio value alert was met."""
+        self.db_manager.portfolio_book.recheck = False
+        for user_id, value, alert in self.db_manager.find_triggered_portfolio_alerts():
+            if self.db_manager.is_user_blocked(user_id):
+                continue
+            try:
+                if send_notifications:
+                    message = f"💼 هشدار ارزش پرتفوی!\n"
+                    message += f"ارزش پرتفوی شما به {value:,.0f} تومان رسید (هدف: {alert['target_value']:,.0f})."
+
+                    key = notification_key("portfolio", user_id, alert.get('last_update'))
+                    await self.outbox.enqueue(key, user_id, message)
+
+                await self.db_manager.update_portfolio_alert_status(user_id, "triggered")
+
+            except Exception as e:
+                logger.error(f"Failed to queue portfolio alert for user {user_id}: {e}")
+                self.db_manager.portfolio_book.recheck = True
     
     async def send_updates_subscription(self, frequency):
         """Sends price updates to all users subscribed to a specific frequency."""
         logger.info(f"Running {frequency} subscription job...")
         
         subscriptions = await self.db_manager.get_subscriptions_by_frequency(frequency)
+        # One digest per subscription per day, even if the job runs again.
+        today = datetime.now(timezone.utc).date().isoformat()
         if not subscriptions:
             logger.info(f"No {frequency} subscriptions to send.")
             return
         for sub in subscriptions:
+            if self.db_manager.is_user_blocked(sub['user_id']):
+                continue
             try:
                 price_data = await self.db_manager.get_currency_info(sub['symbol'])
                 if price_data:
                     message = f"🔔 آپدیت {frequency} برای {price_data['fa_symbol']}:\n"
                     message += f"قیمت: {price_data['price']} تومان"
                     
-                    await self.app.bot.send_message(chat_id=sub['user_id'], text=message)
+                    key = notification_key("digest", sub['_id'], f"{frequency}:{today}")
+                    await self.outbox.enqueue(key, sub['user_id'], message)
             except Exception as e:
-                logger.error(f"Failed to send update to user {sub['user_id']}: {e}")
+                logger.error(f"Failed to queue update for user {sub['user_id']}: {e}")
 
     async def send_all_updates(self):
         logger.info("Running the main daily update job...")
@@ -82,11 +177,21 @@ class Collector:
         if today.day == 1:
             await self.send_updates_subscription("monthly")
 
+    async def save_snapshot(self):
+        await self.db_manager.snapshot.save(self.snapshot_path)
+
     def start_scheduler(self):
-        self.scheduler.add_job(self.get_currency_price, 'interval', minutes=1)
+        # Run the first fetch right away instead of waiting a full interval after startup.
+        self.scheduler.add_job(self.get_currency_price, 'interval', minutes=1, next_run_time=datetime.now(timezone.utc))
+
+        if self.snapshot_path:
+            self.scheduler.add_job(self.save_snapshot, 'interval', minutes=self.snapshot_interval)
 
         self.scheduler.add_job(self.send_all_updates, 'cron', hour=9, minute=0)
 
+        # Usage counters are written in one small batch per minute instead of on every request.
+        self.scheduler.add_job(self.db_manager.flush_stats, 'interval', minutes=1)
+
         self.scheduler.start()
         logger.info("Background data collection scheduler has been started.")
     
@@ -1,64 +1,282 @@
 from datetime import datetime, timezone
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.read_preferences import ReadPreference, Nearest, SecondaryPreferred
 from pymongo.errors import PyMongoError
+from snapshot import PriceSnapshot
+from cache import UserCache
+from portfolio import PortfolioBook
+from stats import StatsCounters, field_name, today_key
 import logging
 import re
 
 logger = logging.getLogger(__name__)
 
+def make_read_preference(mode: str = "primary", max_staleness_seconds: int = -1):
+    """
+    Read preference for latency-tolerant reads: "primary", "secondaryPreferred" or "nearest".
+    max_staleness_seconds (-1 = no limit, otherwise at least 90) bounds how far behind a secondary may be.
+    Raises ValueError for anything else, rather than silently reading from the primary or failing every read.
+    """
+    if mode not in ("primary", "secondaryPreferred", "nearest"):
+        raise ValueError(f"Unknown read preference {mode!r}: use 'primary', 'secondaryPreferred' or 'nearest'.")
+    if max_staleness_seconds != -1 and max_staleness_seconds < 90:
+        raise ValueError(f"Invalid max staleness {max_staleness_seconds}s: use -1 (no limit) or at least 90.")
+    if mode == "secondaryPreferred":
+        return SecondaryPreferred(max_staleness=max_staleness_seconds)
+    if mode == "nearest":
+        return Nearest(max_staleness=max_staleness_seconds)
+    return ReadPreference.PRIMARY
+
 class Database:
-    def __init__(self, db):
+    def __init__(self, db, snapshot: PriceSnapshot = None, background_db=None, read_preference=None):
+        """
+        db: database handle used by the bot's request handlers.
+        background_db: the same database on a separate client (own connection pool) for the
+            collector and the outbox worker. Defaults to db.
+        read_preference: where latency-tolerant reads (lookups, menus, digest scans, charts) go.
+            Writes and read-after-write paths always use the primary.
+        """
         self.db = db
         self.prices = self.db.prices
         self.users = self.db.users
         self.subscriptions = self.db.subscriptions
         self.alerts = self.db.alerts
+        self.price_history = self.db.price_history
+        self.holdings = self.db.holdings
+        self.portfolio_alerts = self.db.portfolio_alerts
+        self.stats_collection = self.db.stats
+
+        # Collections used by the background workload (collector ticks, outbox)
+        background = background_db if background_db is not None else db
+        self.background_prices = background.prices
+        self.background_price_history = background.price_history
+        self.background_alerts = background.alerts
+        self.background_portfolio_alerts = background.portfolio_alerts
+        self.outbox = background.outbox
+
+        # Collections for latency-tolerant reads, which may be served by secondaries
+        self.read_preference = read_preference or ReadPreference.PRIMARY
+        self.prices_read = self.prices.with_options(read_preference=self.read_preference)
+        self.subscriptions_read = self.subscriptions.with_options(read_preference=self.read_preference)
+        self.alerts_read = self.alerts.with_options(read_preference=self.read_preference)
+        self.price_history_read = self.price_history.with_options(read_preference=self.read_preference)
+        self.background_subscriptions_read = background.subscriptions.with_options(read_preference=self.read_preference)
+        # After a user writes, their reads stay on the primary for this long, so they see their own changes.
+        staleness = self.read_preference.max_staleness
+        self.read_your_writes_seconds = staleness if staleness and staleness > 0 else 120
+        # In-memory copy of prices and active alerts, kept in sync by the write methods below.
+        self.snapshot = snapshot if snapshot is not None else PriceSnapshot()
+        # Per-user alert and subscription lists for the menus, invalidated by the write methods below.
+        self.user_alerts_cache = UserCache()
+        self.user_subscriptions_cache = UserCache()
+        # All holdings and active portfolio alerts, for batched valuation on every tick.
+        self.portfolio_book = PortfolioBook()
+        # IDs of users who have blocked the bot. Nothing is sent to them until they /start again.
+        self.blocked_users = set()
+        # Usage counters, updated by the write methods below and flushed to the `stats` collection.
+        self.stats = StatsCounters()
+        # Users already counted as active today (UTC), so activity costs at most one write per user per day.
+        self.active_day = None
+        self.active_users_today = set()
     
     """---------- Get Base Currency Information ----------"""
-    async def update_prices(self, api_response: dict):
-        currency_list = api_response.get("result", {}).get("markets", [])
-        
-        for currency in currency_list:
-            price_value = currency.get("price")
-            if price_value is None:
-                # If the price is not available, log a warning and move on to the next currency.
-                logger.warning(f"Price for currency {currency.get('symbol')} is None. Skipping update for this item.")
+    async def update_prices(self, markets: list):
+        """
+        Writes the markets whose values changed since the last tick (one bulk write) and
+        returns their symbols. Unchanged markets are skipped and keep their last_update.
+        """
+        last_update = datetime.now(timezone.utc)
+        changed = []
+        operations = []
+        for market in markets:
+            previous = self.snapshot.markets.get(market.symbol)
+            if previous is not None and market.same_as(previous):
                 continue
-            try:
-                await self.prices.update_one(
-                    { "_id": currency["symbol"] },
-                    { "$set": { 
-                        "symbol" : currency["base_asset"],
-                        "fa_symbol" : currency["fa_base_asset"],
-                        "en_base_asset" : currency["en_base_asset"],
-                        "price" : float(currency["price"]),
-                        "change_24h" : currency["change_24h"],
-                        "volume_24h" : currency["volume_24h"],
-                        "last_update" : datetime.now(timezone.utc)
-                            } },
-                    upsert=True
-                )
-            except (ValueError, TypeError) as e:
-                logger.error(f"Could not process currency {currency.get('symbol')} due to invalid data: {e}")
+            document = market.document(last_update)
+            changed.append((market.symbol, document))
+            operations.append(UpdateOne({ "_id": market.symbol }, { "$set": document }, upsert=True))
+
+        if not operations:
+            return []
+        try:
+            await self.background_prices.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            # The snapshot is left as it was, so these markets are retried on the next tick.
+            logger.error(f"Database error while updating prices: {e}")
+            return []
+
+        for symbol, document in changed:
+            self.snapshot.set_market(symbol, document)
+
+        # One history point per changed market, for the charts.
+        try:
+            await self.background_price_history.insert_many(
+                [{ "symbol": symbol, "price": document["price"], "time": last_update } for symbol, document in changed],
+                ordered=False
+            )
+        except PyMongoError as e:
+            logger.error(f"Database error while saving price history: {e}")
+        return [symbol for symbol, _ in changed]
+
+    async def get_price_history(self, symbol, since: datetime):
+        """Returns the price points of a market since the given time, oldest first."""
+        cursor = self.price_history_read.find(
+            { "symbol": symbol, "time": { "$gte": since } },
+            { "_id": 0, "price": 1, "time": 1 }
+        ).sort("time", 1)
+        return await cursor.to_list(length=None)
+
+    async def ensure_indexes(self, history_days: int = 31):
+        """Creates the indexes the queries above rely on. Safe to run on every startup."""
+        await self.price_history.create_index([("symbol", 1), ("time", 1)])
+        # Old history points are removed automatically by MongoDB.
+        await self.price_history.create_index("time", expireAfterSeconds=history_days * 24 * 60 * 60)
+        await self.outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+        await self.outbox.create_index("alert_keys", sparse=True)
+        # Delivered (or given up) messages are kept for a week, for troubleshooting.
+        await self.outbox.create_index("closed_at", expireAfterSeconds=7 * 24 * 60 * 60)
 
     """---------- Add User ----------"""
     async def add_or_update_user(self, user_data: dict):
-            await self.users.update_one(
+            previous = await self.users.find_one_and_update(
                 {"_id": user_data.id},
                 {"$set": {
                     "first_name": user_data.first_name,
                     "last_name": user_data.last_name,
                     "username": user_data.username,
-                    "last_seen": datetime.now(timezone.utc)
+                    "last_seen": datetime.now(timezone.utc),
+                    "active_on": datetime.now(timezone.utc).date().isoformat()
                 },
                 "$setOnInsert": {
                     "join_date": datetime.now(timezone.utc)
                 }},
-                upsert=True
+                projection={"active_on": 1, "blocked": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            # A blocked user coming back with /start gets everything reactivated. This is decided by the
+            # stored flag, since blocked_users may not be loaded yet. reactivate_user clears the flag.
+            if (previous and previous.get("blocked")) or user_data.id in self.blocked_users:
+                await self.reactivate_user(user_data.id)
+            if previous is None:
+                self.stats.incr("users")
+                self.stats.incr("new_users", daily=True)
+            if previous is None or previous.get("active_on") != datetime.now(timezone.utc).date().isoformat():
+                self.stats.incr("active_users", daily=True)
+
+    async def record_activity(self, user_id):
+        """
+        Counts the user as active today (UTC), whatever they used the bot for. The user's `active_on`
+        date makes this count each user once per day, also across restarts. Unknown users are counted
+        by add_or_update_user when they /start.
+        """
+        today = datetime.now(timezone.utc).date().isoformat()
+        if self.active_day != today:
+            self.active_day, self.active_users_today = today, set()
+        if user_id in self.active_users_today:
+            return
+        self.active_users_today.add(user_id)
+        try:
+            result = await self.users.update_one({"_id": user_id, "active_on": {"$ne": today}}, {"$set": {"active_on": today}})
+        except PyMongoError as e:
+            self.active_users_today.discard(user_id)
+            logger.error(f"Failed to record activity of user {user_id}: {e}")
+            return
+        if result.modified_count:
+            self.stats.incr("active_users", daily=True)
+
+    """---------- User Liveness ----------"""
+    async def load_blocked_users(self):
+        try:
+            cursor = self.users.find({"blocked": True}, {"_id": 1})
+            self.blocked_users = {user["_id"] for user in await cursor.to_list(length=None)}
+        except PyMongoError as e:
+            logger.error(f"Failed to load blocked users: {e}")
+
+    def is_user_blocked(self, user_id):
+        return user_id in self.blocked_users
+
+    async def mark_user_blocked(self, user_id):
+        """
+        Marks a user as blocked and pauses all their active alerts and subscriptions
+        (one bulk write per collection). Once that has succeeded, repeated calls for the
+        same user are no-ops; if it failed, the next call tries again.
+        """
+        if user_id in self.blocked_users:
+            return
+        try:
+            # Written first: whatever is paused below, a later /start finds the flag and undoes it.
+            await self.users.update_one(
+                {"_id": user_id},
+                {"$set": {"blocked": True, "blocked_at": datetime.now(timezone.utc)}}
             )
+            await self.alerts.update_many(
+                {"user_id": user_id, "status": "active"},
+                {"$set": {"status": "paused"}}
+            )
+            await self.subscriptions.update_many(
+                {"user_id": user_id},
+                {"$set": {"paused": True}}
+            )
+            await self.portfolio_alerts.update_one(
+                {"user_id": user_id, "status": "active"},
+                {"$set": {"status": "paused"}}
+            )
+        except PyMongoError as e:
+            logger.error(f"Failed to deactivate blocked user {user_id}: {e}")
+            return
+        self.blocked_users.add(user_id)
+        self.portfolio_book.remove_alert(user_id)
+
+        for symbol in list(self.snapshot.alert_index):
+            for alert_id, alert in list(self.snapshot.alert_index[symbol].items()):
+                if alert["user_id"] == user_id:
+                    self.snapshot.remove_alert({"_id": alert_id, "symbol": symbol})
+        self.user_alerts_cache.invalidate(user_id)
+        self.user_subscriptions_cache.invalidate(user_id)
+
+    async def reactivate_user(self, user_id):
+        """
+        Undoes mark_user_blocked: alerts and subscriptions paused by it become active again.
+        The user's blocked flag is cleared last, so if a write fails the next /start tries again.
+        """
+        self.blocked_users.discard(user_id)
+        try:
+            await self.alerts.update_many(
+                {"user_id": user_id, "status": "paused"},
+                {"$set": {"status": "active"}}
+            )
+            await self.subscriptions.update_many(
+                {"user_id": user_id, "paused": True},
+                {"$unset": {"paused": ""}}
+            )
+            for alert in await self.alerts.find({"user_id": user_id, "status": "active"}).to_list(length=None):
+                self.snapshot.set_alert(alert)
+            portfolio_alert = await self.portfolio_alerts.find_one_and_update(
+                {"user_id": user_id, "status": "paused"},
+                {"$set": {"status": "active"}},
+                return_document=ReturnDocument.AFTER
+            )
+            if portfolio_alert is not None:
+                self.portfolio_book.set_alert(
+                    user_id, portfolio_alert["target_value"], portfolio_alert["condition"], portfolio_alert.get("last_update")
+                )
+            await self.users.update_one({"_id": user_id}, {"$set": {"blocked": False}})
+        except PyMongoError as e:
+            logger.error(f"Failed to reactivate user {user_id}: {e}")
+        self.user_alerts_cache.invalidate(user_id)
+        self.user_subscriptions_cache.invalidate(user_id)
+        logger.info(f"User {user_id} is back. Their alerts and subscriptions were reactivated.")
 
     """---------- Service 1 : Live Price ----------"""
     async def get_currency_info(self, targeted_currency: str):
+        # Serve from memory once prices are known (from the saved snapshot or the first fetch).
+        # A miss still goes to the database, which may know markets the snapshot doesn't yet.
+        if self.snapshot:
+            result = self.snapshot.lookup(targeted_currency)
+            if result is not None:
+                return result
         try:
             normalized_input = re.sub('[\s\u200c]+', '', targeted_currency)
             regex_pattern = '[\s\u200c]*'.join(list(normalized_input))
@@ -69,7 +287,7 @@ class Database:
                     { "fa_symbol" : { "$regex": f"^{regex_pattern}$", "$options": "i" } }
                 ]
             }
-            result = await self.prices.find_one(query, { "_id": 0 })
+            result = await self.prices_read.find_one(query)
             return result
         except PyMongoError as e:
             logger.error(f"Database error while fetching currency info: {e}")
@@ -77,7 +295,7 @@ class Database:
 
     """---------- Service 2 : Price Subscription ----------"""
     async def add_or_update_subscription(self, user_id, symbol, frequency):
-        await self.subscriptions.update_one(
+        previous = await self.subscriptions.find_one_and_update(
             {
                 "user_id": user_id,
                 "symbol": symbol
@@ -93,20 +311,31 @@ class Database:
                     "join_date": datetime.now(timezone.utc)
                 }
             },
-            upsert=True
+            projection={"frequency": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
+        if previous is None or previous.get("frequency") != frequency:
+            if previous is not None:
+                self.stats.incr(f"subscriptions.{field_name(previous.get('frequency'))}", -1)
+            self.stats.incr(f"subscriptions.{field_name(frequency)}")
+        self.user_subscriptions_cache.invalidate(user_id)
 
     async def get_subscriptions_by_frequency(self, frequency: str):
         try:
-            cursor = self.subscriptions.find({"frequency": frequency})
+            cursor = self.background_subscriptions_read.find({"frequency": frequency, "paused": {"$ne": True}})
             return await cursor.to_list(length=None)
         except PyMongoError as e:
             logger.error(f"Database error while fetching currency info: {e}")
             return []
         
     async def get_user_subscriptions(self, user_id):
-        """Returns a list of all subscriptions for a given user."""
-        return await self.subscriptions.find({"user_id": user_id}).to_list(length=100)
+        """Returns a list of all subscriptions for a given user, ordered by _id."""
+        collection = self.subscriptions if self.user_subscriptions_cache.written_within(user_id, self.read_your_writes_seconds) else self.subscriptions_read
+        return await self.user_subscriptions_cache.get_or_load(
+            user_id,
+            lambda: collection.find({"user_id": user_id}).sort("_id", 1).to_list(length=None)
+        )
     
     async def delete_subscription_by_id(self, subscription_id_str: str):
         """
@@ -116,17 +345,22 @@ class Database:
             # Convert a string ID to a Mongo ObjectId object
             obj_id = ObjectId(subscription_id_str)
             
-            result = await self.subscriptions.delete_one({"_id": obj_id})
+            subscription = await self.subscriptions.find_one_and_delete({"_id": obj_id})
             
             # If a document is deleted, the operation was successful.
-            return result.deleted_count > 0
+            if subscription is None:
+                return False
+
+            self.stats.incr(f"subscriptions.{field_name(subscription.get('frequency'))}", -1)
+            self.user_subscriptions_cache.invalidate(subscription["user_id"])
+            return True
         except Exception as e:
             logger.error(f"Error deleting subscription by ID: {e}")
             return False
     
     """---------- Service 3 : Price Alert ----------"""
     async def set_price_alert(self, user_id, symbol, target_price, condition: str):
-        await self.alerts.update_one(
+        alert = await self.alerts.find_one_and_update(
             { 
                 "user_id" : user_id,
                 "symbol" : symbol
@@ -144,17 +378,42 @@ class Database:
                     "join_date": datetime.now(timezone.utc)
                 }
             },
-            upsert=True
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        self.snapshot.set_alert(alert)
+        self.user_alerts_cache.invalidate(user_id)
+
+    async def get_active_alerts(self):
+        return await self.alerts.find({"status": "active"}).to_list(length=None)
+
+    async def refresh_alert_index(self):
+        """Reloads the in-memory alert index from the database."""
+        try:
+            self.snapshot.set_alerts(await self.get_active_alerts())
+        except PyMongoError as e:
+            logger.error(f"Failed to load active alerts: {e}")
     
-    async def find_triggered_alerts(self):
+    async def find_triggered_alerts(self, symbols=None):
         """
         Finds all active alerts where the target price has been met.
+        If symbols is given, only alerts on those symbols (plus newly set alerts) are checked.
         """
+        if symbols is not None:
+            symbols = set(symbols) | self.snapshot.pop_pending_alert_symbols()
+            if not symbols:
+                return []
+
+        if self.snapshot.alerts_loaded:
+            return self._find_triggered_alerts_in_memory(symbols)
+
+        match = { "status": "active" }
+        if symbols is not None:
+            match["symbol"] = { "$in": list(symbols) }
         pipeline = [
             # Stage 1: Only look at active alerts
             {
-                "$match": { "status": "active" }
+                "$match": match
             },
             # Stage 2: Join with the prices collection
             {
@@ -194,21 +453,56 @@ class Database:
             }
         ]
 
-        cursor = await self.alerts.aggregate(pipeline)
+        cursor = await self.background_alerts.aggregate(pipeline)
         triggered_alerts = await cursor.to_list(length=None)
 
         return triggered_alerts
+
+    def _find_triggered_alerts_in_memory(self, symbols=None):
+        """Same result as the aggregation above, computed from the snapshot without a DB round trip."""
+        triggered_alerts = []
+        if symbols is None:
+            symbols = self.snapshot.alert_index.keys()
+        for symbol in symbols:
+            symbol_alerts = self.snapshot.alert_index.get(symbol)
+            if not symbol_alerts:
+                continue
+            # Like the $lookup stage, the alert symbol is matched against the price _id.
+            price_info = self.snapshot.markets.get(symbol)
+            if price_info is None:
+                continue
+            price = price_info["price"]
+            for alert_id, alert in symbol_alerts.items():
+                if (alert["condition"] == "gte" and price >= alert["target_price"]) or \
+                   (alert["condition"] == "lte" and price <= alert["target_price"]):
+                    triggered_alerts.append({
+                        "_id": alert_id,
+                        "symbol": symbol,
+                        "status": "active",
+                        "price_info": price_info,
+                        **alert
+                    })
+        return triggered_alerts
     
     async def get_user_price_alert(self, user_id):
-        return await self.alerts.find({"user_id": user_id}).to_list(length=100)
+        """Returns a list of all alerts for a given user, ordered by _id."""
+        collection = self.alerts if self.user_alerts_cache.written_within(user_id, self.read_your_writes_seconds) else self.alerts_read
+        return await self.user_alerts_cache.get_or_load(
+            user_id,
+            lambda: collection.find({"user_id": user_id}).sort("_id", 1).to_list(length=None)
+        )
     
     async def delete_price_alert(self, alert_id_str: str):
         try:
             obj_id = ObjectId(alert_id_str)
             
-            result = await self.alerts.delete_one({"_id": obj_id})
+            alert = await self.alerts.find_one_and_delete({"_id": obj_id})
+            if alert is None:
+                return False
             
-            return result.deleted_count > 0
+            self.snapshot.remove_alert(alert)
+            self.user_alerts_cache.invalidate(alert["user_id"])
+            return True
         except Exception as e:
             logger.error(f"Error deleting subscription by ID: {e}")
             return False
@@ -218,12 +512,252 @@ class Database:
         Updates the status of a specific alert (e.g. from 'active' to 'triggered').
         """
         try:
-            result = await self.alerts.update_one(
+            alert = await self.background_alerts.find_one_and_update(
                 {"_id": alert_id},
+                {"$set": {"status": new_status}},
+                return_document=ReturnDocument.AFTER
+            )
+            if alert is None:
+                return False
+
+            if new_status == "active":
+                self.snapshot.set_alert(alert)
+            else:
+                self.snapshot.remove_alert(alert)
+            self.user_alerts_cache.invalidate(alert["user_id"])
+            return True
+        except PyMongoError as e:
+            logger.error(f"Failed to update alert status for {alert_id}: {e}")
+            return False
+
+    async def update_alerts_status(self, alerts: list, new_status: str):
+        """
+        Updates the status of several alerts (documents with _id, user_id and symbol) in one write.
+        Returns the number of alerts changed.
+        """
+        if not alerts:
+            return 0
+        try:
+            result = await self.background_alerts.update_many(
+                {"_id": {"$in": [alert["_id"] for alert in alerts]}},
                 {"$set": {"status": new_status}}
             )
-            # Returns True if a document has changed.
+        except PyMongoError as e:
+            logger.error(f"Failed to update the status of {len(alerts)} alerts: {e}")
+            # They are still active; without this they would only be checked again when their price changes.
+            self.snapshot.recheck_alerts(alert["symbol"] for alert in alerts)
+            return 0
+        if new_status == "triggered":
+            self.stats.incr("alerts_triggered", result.modified_count)
+            self.stats.incr("alerts_triggered", result.modified_count, daily=True)
+
+        for alert in alerts:
+            if new_status == "active":
+                self.snapshot.set_alert(alert)
+            else:
+                self.snapshot.remove_alert(alert)
+            self.user_alerts_cache.invalidate(alert["user_id"])
+        return result.modified_count
+
+    """---------- Service 4 : Portfolio ----------"""
+    async def load_portfolios(self):
+        """Loads all holdings and active portfolio alerts into the in-memory book."""
+        try:
+            self.portfolio_book.set_holdings(await self.holdings.find({}).to_list(length=None))
+            self.portfolio_book.set_alerts(await self.portfolio_alerts.find({"status": "active"}).to_list(length=None))
+        except PyMongoError as e:
+            logger.error(f"Failed to load portfolios: {e}")
+
+    async def add_or_update_holding(self, user_id, symbol, amount: float):
+        """Sets the amount held of a market (e.g. "BTCTMN") in the user's portfolio."""
+        await self.holdings.update_one(
+            {
+                "user_id": user_id,
+                "symbol": symbol
+            },
+            {
+                "$set": {
+                    "amount": float(amount),
+                    "last_update": datetime.now(timezone.utc)
+                },
+                "$setOnInsert": {
+                    "user_id": user_id,
+                    "symbol": symbol,
+                    "join_date": datetime.now(timezone.utc)
+                }
+            },
+            upsert=True
+        )
+        self.portfolio_book.set_holding(user_id, symbol, float(amount))
+
+    async def delete_holding(self, user_id, symbol):
+        try:
+            result = await self.holdings.delete_one({"user_id": user_id, "symbol": symbol})
+            self.portfolio_book.remove_holding(user_id, symbol)
+            return result.deleted_count > 0
+        except PyMongoError as e:
+            logger.error(f"Error deleting holding: {e}")
+            return False
+
+    def get_user_portfolio(self, user_id):
+        """Returns ({market: amount}, total value, active value alert or None) for the user, from memory."""
+        holdings = self.portfolio_book.user_holdings(user_id)
+        value = self.portfolio_book.value_of(user_id, self.snapshot)
+        return holdings, value, self.portfolio_book.alerts.get(user_id)
+
+    async def set_portfolio_alert(self, user_id, target_value, condition: str):
+        last_update = datetime.now(timezone.utc)
+        await self.portfolio_alerts.update_one(
+            { "user_id" : user_id },
+            {
+                "$set" : {
+                    "target_value" : float(target_value),
+                    "status": "active",
+                    "condition": condition,
+                    "last_update": last_update
+                },
+                "$setOnInsert" : {
+                    "user_id" : user_id,
+                    "join_date": datetime.now(timezone.utc)
+                }
+            },
+            upsert=True
+        )
+        self.portfolio_book.set_alert(user_id, float(target_value), condition, last_update)
+
+    async def delete_portfolio_alert(self, user_id):
+        try:
+            result = await self.portfolio_alerts.delete_one({"user_id": user_id})
+            self.portfolio_book.remove_alert(user_id)
+            return result.deleted_count > 0
+        except PyMongoError as e:
+            logger.error(f"Error deleting portfolio alert: {e}")
+            return False
+
+    def find_triggered_portfolio_alerts(self):
+        """Revalues every portfolio at the current prices and returns [(user_id, value, alert)] that met their target."""
+        return self.portfolio_book.find_triggered_alerts(self.snapshot)
+
+    async def update_portfolio_alert_status(self, user_id, new_status: str):
+        try:
+            result = await self.background_portfolio_alerts.update_one(
+                {"user_id": user_id},
+                {"$set": {"status": new_status}}
+            )
+            if new_status != "active":
+                self.portfolio_book.remove_alert(user_id)
             return result.modified_count > 0
         except PyMongoError as e:
-            logger.error(f"Failed to update alert status for {alert_id}: {e}")
-            return False
\ No newline at end of file
+            logger.error(f"Failed to update portfolio alert status for {user_id}: {e}")
+            self.portfolio_book.recheck = True
+            return False
+
+    """---------- Outbox ----------"""
+    async def enqueue_message(self, key: str, chat_id, text: str):
+        """Adds a message to the outbox. The key is the document _id, so enqueueing the same key again is a no-op."""
+        await self.enqueue_messages([(key, chat_id, text)])
+
+    async def enqueue_messages(self, messages):
+        """
+        Adds [(key, chat_id, text)] to the outbox in one bulk write. A message that combines several
+        alerts is (key, chat_id, text, alert keys); the alert keys are stored for get_queued_alert_keys.
+        """
+        now = datetime.now(timezone.utc)
+        operations = []
+        for message in messages:
+            key, chat_id, text = message[:3]
+            document = {
+                "chat_id": chat_id,
+                "text": text,
+                "status": "pending",
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now
+            }
+            if len(message) > 3:
+                document["alert_keys"] = message[3]
+            operations.append(UpdateOne({"_id": key}, {"$setOnInsert": document}, upsert=True))
+        await self.outbox.bulk_write(operations, ordered=False)
+
+    async def get_queued_alert_keys(self, alert_keys):
+        """Returns which of the given alert keys are already part of a message in the outbox."""
+        if not alert_keys:
+            return set()
+        cursor = self.outbox.find({"alert_keys": {"$in": list(alert_keys)}}, {"alert_keys": 1})
+        queued = {key for message in await cursor.to_list(length=None) for key in message["alert_keys"]}
+        return queued & set(alert_keys)
+
+    async def get_due_messages(self, limit: int):
+        cursor = self.outbox.find(
+            {"status": "pending", "next_attempt_at": {"$lte": datetime.now(timezone.utc)}}
+        ).sort("next_attempt_at", 1).limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def record_message_results(self, results):
+        """Saves the outcome of a batch of sends in one bulk write. results: [(message _id, (state, retry_at))]"""
+        now = datetime.now(timezone.utc)
+        operations = []
+        for message_id, (state, retry_at) in results:
+            if state == "retry":
+                operations.append(UpdateOne(
+                    {"_id": message_id},
+                    {"$set": {"next_attempt_at": retry_at}, "$inc": {"attempts": 1}}
+                ))
+            else:
+                operations.append(UpdateOne(
+                    {"_id": message_id},
+                    {"$set": {"status": state, "closed_at": now}}
+                ))
+        if operations:
+            await self.outbox.bulk_write(operations, ordered=False)
+
+    """---------- Statistics ----------"""
+    async def seed_stats(self):
+        """
+        Counts users and subscriptions once, the first time the bot runs with statistics.
+        From then on the counters are only updated incrementally by the write methods above.
+        """
+        try:
+            if await self.stats_collection.find_one({"_id": "totals", "users": {"$exists": True}}, {"_id": 1}):
+                return
+            # Dropped before counting: changes made so far are in the counts below. A change that lands while
+            # counting may be counted twice, which is better than losing it.
+            self.stats.discard("totals", ("users", "subscriptions."))
+            users = await self.users.count_documents({})
+            cursor = await self.subscriptions.aggregate([{"$group": {"_id": "$frequency", "count": {"$sum": 1}}}])
+            subscriptions = {field_name(group["_id"]): group["count"] for group in await cursor.to_list(length=None)}
+            await self.stats_collection.update_one(
+                {"_id": "totals"},
+                {"$set": {"users": users, "subscriptions": subscriptions}},
+                upsert=True
+            )
+            logger.info(f"Statistics seeded: {users} users, {sum(subscriptions.values())} subscriptions.")
+        except PyMongoError as e:
+            logger.error(f"Failed to seed statistics: {e}")
+
+    def stats_gauges(self):
+        """Current values that are already kept in memory, so they are read rather than counted."""
+        gauges = {
+            "blocked_users": len(self.blocked_users),
+            "portfolios": len(self.portfolio_book.holdings),
+            "portfolio_alerts": len(self.portfolio_book.alerts)
+        }
+        if self.snapshot.alerts_loaded:
+            gauges["alerts"] = {field_name(symbol): len(alerts) for symbol, alerts in self.snapshot.alert_index.items() if alerts}
+        return gauges
+
+    async def flush_stats(self):
+        await self.stats.flush(self.stats_collection, self.stats_gauges())
+
+    async def get_stats(self):
+        """Returns {"totals": {...}, "today": {...}}: two reads by _id plus the counters not yet flushed."""
+        today = today_key()
+        totals, daily = {}, {}
+        try:
+            totals = await self.stats_collection.find_one({"_id": "totals"}, {"_id": 0}) or {}
+            daily = await self.stats_collection.find_one({"_id": today}, {"_id": 0}) or {}
+        except PyMongoError as e:
+            logger.error(f"Failed to read statistics: {e}")
+        totals = self.stats.apply_pending("totals", totals)
+        totals.update(self.stats_gauges())
+        return {"totals": totals, "today": self.stats.apply_pending(today, daily)}
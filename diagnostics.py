@@ -0,0 +1,122 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+"""---------- Sampling Profiler ----------"""
+class SamplingProfiler:
+    """
+    A tiny stack-sampling profiler for the event loop thread.
+    Nothing runs until start() is called, and the sampler thread exits on its own
+    after the requested duration. The output is written in the "folded stacks"
+    format (one `frame;frame;frame count` line per stack), which can be fed
+    straight into flamegraph.pl or speedscope.
+    """
+    def __init__(self, output_dir: str = "profiles", interval: float = 0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, target_thread_id: int = None):
+        """Starts sampling in the background. Returns the path the profile will be written to, or None if already running."""
+        if self.running:
+            return None
+        if target_thread_id is None:
+            # The bot's event loop runs in the main thread (run_polling).
+            target_thread_id = threading.main_thread().ident
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_name = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        output_path = os.path.join(self.output_dir, file_name)
+
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(duration, target_thread_id, output_path),
+            name="sampling-profiler",
+            daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Sampling profiler started for {duration}s. Output: {output_path}")
+        return output_path
+
+    def _run(self, duration, target_thread_id, output_path):
+        stacks = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(target_thread_id)
+            if frame is not None:
+                stacks[self._fold(frame)] += 1
+            time.sleep(self.interval)
+
+        try:
+            with open(output_path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Sampling profiler finished: {sum(stacks.values())} samples written to {output_path}")
+        except OSError as e:
+            logger.error(f"Could not write profile to {output_path}: {e}")
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        # Root first, leaf last.
+        return ";".join(reversed(names))
+
+"""---------- Slow Query Log ----------"""
+def enable_slow_query_log(db_manager, threshold_ms: float):
+    """
+    Wraps every public coroutine method of the given Database instance so calls
+    slower than threshold_ms are logged with their arguments (the filter) and timing.
+    Only call this when the feature is switched on; the class itself is left untouched.
+    """
+    threshold = threshold_ms / 1000
+    slow_logger = logging.getLogger("slow_query")
+
+    def wrap(name, method):
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if elapsed >= threshold:
+                    slow_logger.warning(
+                        f"Slow Database call {name} took {elapsed * 1000:.1f}ms (args={args!r}, kwargs={kwargs!r})"
+                    )
+        return timed
+
+    for name, method in inspect.getmembers(db_manager, inspect.iscoroutinefunction):
+        if not name.startswith("_"):
+            setattr(db_manager, name, wrap(name, method))
+    logger.info(f"Slow query log enabled (threshold: {threshold_ms}ms).")
+
+"""---------- Slow Callback Detector ----------"""
+def enable_slow_callback_detector(threshold_ms: float, loop: asyncio.AbstractEventLoop = None):
+    """
+    Turns on asyncio debug mode so that any callback or task step holding the
+    event loop longer than threshold_ms is reported by the 'asyncio' logger.
+    Debug mode has a runtime cost, so this is only enabled on request.
+    """
+    loop = loop or asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold_ms / 1000
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.info(f"Slow callback detector enabled (threshold: {threshold_ms}ms).")
@@ -1,4 +1,6 @@
 import os
+import signal
+import asyncio
 import logging
 from dotenv import load_dotenv
 
@@ -7,9 +9,16 @@ from pymongo.asynchronous.mongo_client import AsyncMongoClient
 from telegram.ext import Application, PicklePersistence, PersistenceInput
 
 import config
-from database import Database
+from database import Database, make_read_preference
 from data_collector import Collector
 from bot import Bot
+from snapshot import PriceSnapshot
+from throttling import ThrottlingUpdateProcessor
+from tape import TapeWriter
+from charts import ChartService
+from outbox import Outbox
+from stats import StatsHttpServer
+from diagnostics import SamplingProfiler, enable_slow_query_log, enable_slow_callback_detector
 
 logger = logging.getLogger(__name__)
 
@@ -18,43 +27,157 @@ logger = logging.getLogger(__name__)
 async def post_init(app: Application):
     """Things to do after the bot is initially prepared."""
     logger.info("Bot is initialized. Setting up database and services...")
-    
-    # Connecting to the database and pinging
+
+    # Load the last saved prices first, so lookups work before MongoDB and the first fetch are ready.
+    app.snapshot_path = os.getenv("SNAPSHOT_PATH", "price_snapshot.bin")
+    snapshot = PriceSnapshot()
+    snapshot.load(app.snapshot_path)
+
+    # Creating the database clients (they connect lazily; the ping happens in the background).
+    # The bot's handlers and the background work (collector, outbox) get separate connection pools,
+    # so a burst of collector writes can't take all the connections user requests need.
     mongo_uri = os.getenv("MONGO_URI")
     db_name = os.getenv("DB_NAME")
+    server_api = pymongo.server_api.ServerApi(version="1", strict=True, deprecation_errors=True)
     app.mongo_client = AsyncMongoClient(
         mongo_uri,
-        server_api=pymongo.server_api.ServerApi(version="1", strict=True, deprecation_errors=True)
+        server_api=server_api,
+        maxPoolSize=int(os.getenv("BOT_MONGO_POOL_SIZE", "50"))
+    )
+    app.background_mongo_client = AsyncMongoClient(
+        mongo_uri,
+        server_api=server_api,
+        maxPoolSize=int(os.getenv("COLLECTOR_MONGO_POOL_SIZE", "10"))
     )
-    await app.mongo_client.admin.command('ping')
-    logger.info("Successfully connected and pinged MongoDB!")
 
-    db = app.mongo_client[db_name]
-    app.db_manager = Database(db)
-    
+    # Latency-tolerant reads may go to secondaries (needs a replica set); the default keeps everything on the primary.
+    read_preference = make_read_preference(
+        os.getenv("MONGO_READ_PREFERENCE", "primary"),
+        int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "-1"))
+    )
+    app.db_manager = Database(
+        app.mongo_client[db_name],
+        snapshot=snapshot,
+        background_db=app.background_mongo_client[db_name],
+        read_preference=read_preference
+    )
+
+    # Diagnostics (all off by default)
+    slow_query_ms = os.getenv("SLOW_QUERY_MS")
+    if slow_query_ms:
+        enable_slow_query_log(app.db_manager, float(slow_query_ms))
+    slow_callback_ms = os.getenv("SLOW_CALLBACK_MS")
+    if slow_callback_ms:
+        enable_slow_callback_detector(float(slow_callback_ms))
+
+    profiler = SamplingProfiler(output_dir=os.getenv("PROFILE_OUTPUT_DIR", "profiles"))
+    app.bot_data['profiler'] = profiler
+    # `kill -USR1 <pid>` starts a profiling session without going through Telegram.
+    if hasattr(signal, "SIGUSR1"):
+        signal_duration = float(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.start, signal_duration)
+
+    app.bot_data['charts'] = ChartService(app.db_manager, max_workers=int(os.getenv("CHART_WORKERS", "2")))
+
+    # Don't hold up polling on the database; the bot already answers from the snapshot.
+    app.startup_task = asyncio.create_task(start_services(app))
+
+async def start_services(app: Application):
+    """
+    Pings MongoDB (retrying with backoff until it answers), syncs the in-memory state and starts
+    the outbox worker and the collector. Until then the bot serves prices from the snapshot.
+    """
+    delay = 1
+    while True:
+        try:
+            await app.mongo_client.admin.command('ping')
+            logger.info("Successfully connected and pinged MongoDB!")
+            break
+        except Exception as e:
+            logger.error(f"Could not connect to MongoDB, retrying in {delay}s. Prices, alerts and notifications are paused until then: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    try:
+        await app.db_manager.ensure_indexes()
+    except Exception:
+        logger.exception("Could not create database indexes.")
+
+    await app.db_manager.load_blocked_users()
+    await app.db_manager.load_portfolios()
+
+    # The saved alert index may be behind the database (e.g. after a crash), so reload it.
+    await app.db_manager.refresh_alert_index()
+    await app.db_manager.seed_stats()
+
+    # Outbound notifications are delivered from the durable outbox by a background worker.
+    outbox = Outbox(db_manager=app.db_manager, bot=app.bot)
+    outbox.start()
+    app.bot_data['outbox'] = outbox
+
     # Construction and commissioning of the collector
     wallex_api_key = os.getenv("WALLEX_API_KEY")
-    collector = Collector(api_key=wallex_api_key, db_manager=app.db_manager, app=app)
+    tape_dir = os.getenv("TAPE_DIR")
+    collector = Collector(
+        api_key=wallex_api_key,
+        db_manager=app.db_manager,
+        app=app,
+        snapshot_path=app.snapshot_path,
+        snapshot_interval=int(os.getenv("SNAPSHOT_INTERVAL_MINUTES", "5")),
+        tape=TapeWriter(tape_dir) if tape_dir else None,
+        outbox=outbox,
+        alerts_per_message=int(os.getenv("ALERTS_PER_MESSAGE", "20"))
+    )
     collector.start_scheduler()
     app.bot_data['collector'] = collector
+
+    # Optional JSON endpoint for dashboards: GET /stats
+    stats_port = os.getenv("STATS_HTTP_PORT")
+    if stats_port:
+        stats_server = StatsHttpServer(
+            app.db_manager,
+            host=os.getenv("STATS_HTTP_HOST", "127.0.0.1"),
+            port=int(stats_port),
+            token=os.getenv("STATS_HTTP_TOKEN")
+        )
+        try:
+            await stats_server.start()
+            app.bot_data['stats_server'] = stats_server
+        except OSError:
+            logger.exception("Could not start the stats endpoint.")
     logger.info("Background services started.")
 
 async def post_stop(app: Application):
     """Things to do before the bot completely shuts down."""
     logger.info("Application is shutting down...")
-    if hasattr(app, 'collector'):
-        app.collector.stop_scheduler()
+    if hasattr(app, 'startup_task') and not app.startup_task.done():
+        app.startup_task.cancel()
+    if 'stats_server' in app.bot_data:
+        await app.bot_data['stats_server'].stop()
+    if 'collector' in app.bot_data:
+        app.bot_data['collector'].stop_scheduler()
+        await app.db_manager.flush_stats()
+    # Deliver what is already queued; anything left stays in the outbox for the next start.
+    if 'outbox' in app.bot_data:
+        await app.bot_data['outbox'].stop()
+    if 'charts' in app.bot_data:
+        app.bot_data['charts'].shutdown()
+    if hasattr(app, 'db_manager'):
+        await app.db_manager.snapshot.save(app.snapshot_path)
     if hasattr(app, 'mongo_client'):
         await app.mongo_client.close()
+        await app.background_mongo_client.close()
         logger.info("MongoDB connection closed.")
 
 
 def main():
     """The main starting point of the program."""
-    logger.info("Application starting up...")
     load_dotenv()
+    config.setup_logging()
+    logger.info("Application starting up...")
     
     telegram_token = os.getenv("TELEGRAM_TOKEN")
+    admin_ids = [int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()]
     
     persistence_input = PersistenceInput(
         user_data=True,
@@ -67,19 +190,29 @@ def main():
         store_data=persistence_input
     )
 
+    # Per-user rate limiting and overload shedding in front of all handlers
+    update_processor = ThrottlingUpdateProcessor(
+        rate=float(os.getenv("USER_RATE_LIMIT", "1")),
+        burst=float(os.getenv("USER_RATE_BURST", "5")),
+        budget=int(os.getenv("MAX_UPDATES_IN_FLIGHT", "64"))
+    )
+
     # Building an application and registering startup and shutdown functions
     application = (
         Application.builder()
         .token(telegram_token)
         .persistence(persistence)
+        .concurrent_updates(update_processor)
         .post_init(post_init)
         .post_stop(post_stop)
         .build()
     )
 
     # Creating a bot instance and adding handlers
-    telegram_bot = Bot() 
+    telegram_bot = Bot(admin_ids=admin_ids)
+    application.add_handler(telegram_bot.get_activity_handler(), group=-1)
     application.add_handler(telegram_bot.get_conv_handler())
+    application.add_handlers(telegram_bot.get_admin_handlers())
 
     # Running the Bot
     application.run_polling()
@@ -0,0 +1,73 @@
+import logging
+
+try:
+    # orjson parses straight from bytes and is several times faster than the standard library.
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+class Market:
+    """One market from the Wallex markets payload, keeping only the fields the bot uses."""
+    __slots__ = ("symbol", "base_asset", "fa_base_asset", "en_base_asset", "price", "change_24h", "volume_24h")
+
+    def __init__(self, symbol, base_asset, fa_base_asset, en_base_asset, price, change_24h, volume_24h):
+        self.symbol = symbol
+        self.base_asset = base_asset
+        self.fa_base_asset = fa_base_asset
+        self.en_base_asset = en_base_asset
+        self.price = price
+        self.change_24h = change_24h
+        self.volume_24h = volume_24h
+
+    def __repr__(self):
+        return f"Market({self.symbol}={self.price})"
+
+    def same_as(self, document: dict):
+        """True if the stored price document already has this market's values."""
+        return (
+            document["price"] == self.price
+            and document["change_24h"] == self.change_24h
+            and document["volume_24h"] == self.volume_24h
+        )
+
+    def document(self, last_update):
+        """The document stored in the `prices` collection (without _id, which is the market symbol)."""
+        return {
+            "symbol" : self.base_asset,
+            "fa_symbol" : self.fa_base_asset,
+            "en_base_asset" : self.en_base_asset,
+            "price" : self.price,
+            "change_24h" : self.change_24h,
+            "volume_24h" : self.volume_24h,
+            "last_update" : last_update
+        }
+
+
+def decode_markets(raw: bytes):
+    """Parses the raw markets response into a list of Market records, skipping invalid entries."""
+    currency_list = _loads(raw).get("result", {}).get("markets", [])
+
+    markets = []
+    for currency in currency_list:
+        price_value = currency.get("price")
+        if price_value is None:
+            # If the price is not available, log a warning and move on to the next currency.
+            logger.warning(f"Price for currency {currency.get('symbol')} is None. Skipping update for this item.")
+            continue
+        try:
+            markets.append(Market(
+                currency["symbol"],
+                currency["base_asset"],
+                currency["fa_base_asset"],
+                currency["en_base_asset"],
+                float(price_value),
+                currency["change_24h"],
+                currency["volume_24h"]
+            ))
+        except (KeyError, ValueError, TypeError) as e:
+            logger.error(f"Could not process currency {currency.get('symbol')} due to invalid data: {e}")
+    return markets
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from telegram.error import Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+def notification_key(kind: str, identifier, version=None):
+    """
+    Builds the idempotency key of an outbox message, e.g. "alert:<id>:<ms>".
+    Enqueueing the same key twice (e.g. after a crash between enqueueing and saving the
+    alert's new status) only stores the message once.
+    """
+    if isinstance(version, datetime):
+        # MongoDB stores naive UTC datetimes with millisecond precision; normalize so both forms match.
+        if version.tzinfo is None:
+            version = version.replace(tzinfo=timezone.utc)
+        version = int(version.timestamp() * 1000)
+    return f"{kind}:{identifier}:{version}"
+
+
+class Outbox:
+    """
+    Durable queue of outbound Telegram messages, stored in the `outbox` collection.
+
+    Producers (alerts, digests) call enqueue() before recording their state change, so a
+    message is never lost; the idempotency key makes that safe to repeat. A background worker
+    drains pending messages in batches and marks them sent only after Telegram accepted them
+    (at-least-once delivery). Failed sends are retried with backoff.
+    """
+    def __init__(self, db_manager, bot, batch_size: int = 100, concurrency: int = 8, poll_interval: float = 5.0,
+                 max_attempts: int = 5):
+        self.db_manager = db_manager
+        self.bot = bot
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    async def enqueue(self, key: str, chat_id, text: str):
+        await self.db_manager.enqueue_message(key, chat_id, text)
+        self._wakeup.set()
+
+    async def enqueue_many(self, messages):
+        """Enqueues [(key, chat_id, text)] (or (key, chat_id, text, alert keys)) with one bulk write."""
+        if not messages:
+            return
+        await self.db_manager.enqueue_messages(messages)
+        self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox worker started.")
+
+    async def stop(self, timeout: float = 30.0):
+        """Stops the worker after it has drained what is pending (or after timeout seconds)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox was not fully drained before shutdown; the rest will be sent after restart.")
+        self._task = None
+        logger.info("Outbox worker stopped.")
+
+    async def _run(self):
+        while True:
+            try:
+                sent_any = await self.drain_batch()
+            except Exception:
+                logger.exception("Outbox worker failed to process a batch.")
+                sent_any = False
+
+            if sent_any:
+                continue
+            if self._stopping:
+                return
+            # Nothing to do: wait until something is enqueued (or poll for retries that became due).
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_batch(self):
+        """Sends one batch of due messages. Returns True if there was anything to send."""
+        messages = await self.db_manager.get_due_messages(self.batch_size)
+        if not messages:
+            return False
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def send(message):
+            async with semaphore:
+                return message["_id"], await self._send(message)
+
+        results = await asyncio.gather(*(send(message) for message in messages))
+        await self.db_manager.record_message_results(results)
+        return True
+
+    async def _send(self, message):
+        """Sends one message and returns its new state: ("sent"|"dropped"|"failed"|"retry", retry_at)."""
+        chat_id = message["chat_id"]
+        if self.db_manager.is_user_blocked(chat_id):
+            return "dropped", None
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=message["text"])
+            return "sent", None
+
+        # This error occurs if the user has blocked the bot.
+        except Forbidden:
+            logger.warning(f"User {chat_id} has blocked the bot. Deactivating their alerts.")
+            await self.db_manager.mark_user_blocked(chat_id)
+            return "dropped", None
+
+        except RetryAfter as e:
+            retry_after = e.retry_after if isinstance(e.retry_after, timedelta) else timedelta(seconds=e.retry_after)
+            return "retry", datetime.now(timezone.utc) + retry_after
+
+        except Exception as e:
+            attempts = message.get("attempts", 0) + 1
+            logger.error(f"Failed to send message {message['_id']} to user {chat_id} (attempt {attempts}): {e}")
+            if attempts >= self.max_attempts:
+                return "failed", None
+            # Exponential backoff: 2s, 4s, 8s, ...
+            return "retry", datetime.now(timezone.utc) + timedelta(seconds=2 ** attempts)
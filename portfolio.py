@@ -0,0 +1,129 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PortfolioBook:
+    """
+    In-memory copy of all users' holdings and active portfolio value alerts.
+
+    Holdings form a sparse (portfolio x market) matrix, kept as three flat arrays (row, column, amount).
+    Revaluing every portfolio is then one sparse matrix-vector product with the current price vector:
+    values = bincount(rows, amounts * prices[columns]). This makes a tick's valuation a single
+    vectorized pass, however many portfolios there are.
+    """
+    def __init__(self):
+        self.holdings = {}  # user_id -> {market_id: amount}
+        self.alerts = {}    # user_id -> {"target_value", "condition", "last_update"}
+        self._dirty = True
+        self._user_ids = []
+        self._market_ids = []
+        self._rows = self._columns = self._amounts = None
+        # Alert targets and conditions aligned with the matrix rows (NaN target = no alert).
+        self._alerts_dirty = True
+        self._targets = self._gte = None
+        # Set when handling a triggered alert failed, so alerts are checked again even if no price changes.
+        self.recheck = False
+
+    """---------- Holdings ----------"""
+    def set_holdings(self, holdings):
+        """Rebuilds the book from a list of holding documents."""
+        self.holdings = {}
+        for holding in holdings:
+            self.holdings.setdefault(holding["user_id"], {})[holding["symbol"]] = holding["amount"]
+        self._dirty = True
+
+    def set_holding(self, user_id, market_id, amount: float):
+        self.holdings.setdefault(user_id, {})[market_id] = amount
+        self._dirty = True
+
+    def remove_holding(self, user_id, market_id):
+        user_holdings = self.holdings.get(user_id)
+        if user_holdings is not None:
+            user_holdings.pop(market_id, None)
+            if not user_holdings:
+                del self.holdings[user_id]
+            self._dirty = True
+
+    def user_holdings(self, user_id):
+        return self.holdings.get(user_id, {})
+
+    """---------- Value Alerts ----------"""
+    def set_alerts(self, alerts):
+        self.alerts = {}
+        for alert in alerts:
+            self.set_alert(alert["user_id"], alert["target_value"], alert["condition"], alert.get("last_update"))
+
+    def set_alert(self, user_id, target_value: float, condition: str, last_update=None):
+        self.alerts[user_id] = {"target_value": target_value, "condition": condition, "last_update": last_update}
+        self._alerts_dirty = True
+        if user_id not in self.holdings:
+            # A user with an alert but no holdings still needs a row (worth 0), or an "lte" alert never fires.
+            self._dirty = True
+
+    def remove_alert(self, user_id):
+        if self.alerts.pop(user_id, None) is not None:
+            self._alerts_dirty = True
+
+    """---------- Valuation ----------"""
+    def _build(self):
+        """Flattens the holdings dicts into the sparse matrix arrays. Only runs after holdings changed."""
+        # numpy is imported on first use, to keep it off the bot's startup path.
+        import numpy as np
+        market_columns = {}
+        rows, columns, amounts = [], [], []
+        # One row per user with holdings or a value alert.
+        self._user_ids = list(self.holdings) + [user_id for user_id in self.alerts if user_id not in self.holdings]
+        for row, user_id in enumerate(self._user_ids):
+            for market_id, amount in self.holdings.get(user_id, {}).items():
+                rows.append(row)
+                columns.append(market_columns.setdefault(market_id, len(market_columns)))
+                amounts.append(amount)
+        self._market_ids = list(market_columns)
+        self._rows = np.array(rows, dtype=np.int64)
+        self._columns = np.array(columns, dtype=np.int64)
+        self._amounts = np.array(amounts, dtype=np.float64)
+        self._dirty = False
+        self._alerts_dirty = True
+
+    def _build_alerts(self):
+        import numpy as np
+        targets = np.full(len(self._user_ids), np.nan)
+        gte = np.zeros(len(self._user_ids), dtype=bool)
+        for row, user_id in enumerate(self._user_ids):
+            alert = self.alerts.get(user_id)
+            if alert is not None:
+                targets[row] = alert["target_value"]
+                gte[row] = alert["condition"] == "gte"
+        self._targets, self._gte = targets, gte
+        self._alerts_dirty = False
+
+    def revalue(self, snapshot):
+        """Returns (user IDs, values) for every portfolio at the snapshot's current prices."""
+        import numpy as np
+        if self._dirty:
+            self._build()
+        # Markets without a known price count as zero.
+        prices = np.array([snapshot.get_price(market_id) or 0.0 for market_id in self._market_ids], dtype=np.float64)
+        values = np.bincount(
+            self._rows,
+            weights=self._amounts * prices[self._columns] if len(self._rows) else None,
+            minlength=len(self._user_ids)
+        ).astype(np.float64)
+        return self._user_ids, values
+
+    def value_of(self, user_id, snapshot):
+        """Value of a single portfolio, for on-demand requests."""
+        return sum(amount * (snapshot.get_price(market_id) or 0.0) for market_id, amount in self.user_holdings(user_id).items())
+
+    def find_triggered_alerts(self, snapshot):
+        """Returns [(user_id, value, alert)] for portfolio alerts whose condition is met at current prices."""
+        if not self.alerts:
+            return []
+        import numpy as np
+        user_ids, values = self.revalue(snapshot)
+        if self._alerts_dirty:
+            self._build_alerts()
+
+        has_alert = ~np.isnan(self._targets)
+        met = has_alert & np.where(self._gte, values >= self._targets, values <= self._targets)
+        return [(user_ids[row], float(values[row]), self.alerts[user_ids[row]]) for row in np.flatnonzero(met)]
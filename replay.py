@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+from dotenv import load_dotenv
+
+import pymongo
+from pymongo.asynchronous.mongo_client import AsyncMongoClient
+
+import config
+from database import Database
+from data_collector import Collector
+from tape import read_tape
+from markets import decode_markets
+
+logger = logging.getLogger(__name__)
+
+"""
+Replays recorded market data tapes through the same parsing, price writes and alert
+evaluation the collector runs every minute. No Telegram messages are sent.
+
+    python replay.py tapes/markets-20261019.tape.gz --speed 10
+    python replay.py tapes/*.tape.gz --speed max
+
+By default it writes to "<DB_NAME>_replay", so a replay never touches the live database.
+With --alerts-from, the active alerts of another database (e.g. the live one, which is only
+read) replace the replay database's alerts before the run, so every run checks the same set:
+
+    python replay.py tapes/*.tape.gz --alerts-from crypto_bot_db
+"""
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def copy_alerts(mongo_client, source_db_name, db_name):
+    """Replaces the alerts of the replay database with the active alerts of source_db_name."""
+    alerts = await mongo_client[source_db_name].alerts.find({"status": "active"}).to_list(length=None)
+    await mongo_client[db_name].alerts.delete_many({})
+    if alerts:
+        await mongo_client[db_name].alerts.insert_many(alerts)
+    logger.info(f"Copied {len(alerts)} active alerts from {source_db_name}.")
+
+async def replay(paths, speed, db_name, alerts_from=None):
+    mongo_client = AsyncMongoClient(
+        os.getenv("MONGO_URI"),
+        server_api=pymongo.server_api.ServerApi(version="1", strict=True, deprecation_errors=True)
+    )
+    try:
+        if alerts_from:
+            await copy_alerts(mongo_client, alerts_from, db_name)
+        db_manager = Database(mongo_client[db_name])
+        await db_manager.refresh_alert_index()
+        collector = Collector(api_key=None, db_manager=db_manager, app=None)
+
+        tick_times = []
+        markets = 0
+        triggered = 0
+        started = time.perf_counter()
+        previous_timestamp = None
+        for path in paths:
+            logger.info(f"Replaying {path}...")
+            for timestamp, raw in read_tape(path):
+                # Keep the recorded spacing between ticks, sped up N times.
+                if speed and previous_timestamp is not None:
+                    await asyncio.sleep(max(0.0, (timestamp - previous_timestamp) / speed - (tick_times[-1] if tick_times else 0)))
+                previous_timestamp = timestamp
+
+                tick_started = time.perf_counter()
+                tick_markets = decode_markets(raw)
+                triggered_alerts = await collector.process_markets(tick_markets, send_notifications=False)
+                tick_times.append(time.perf_counter() - tick_started)
+
+                markets += len(tick_markets)
+                triggered += len(triggered_alerts)
+                for alert in triggered_alerts:
+                    logger.info(f"Tick {timestamp:.0f}: alert {alert['_id']} ({alert['symbol']} {alert['condition']} {alert['target_price']}) triggered for user {alert['user_id']}.")
+
+        total = time.perf_counter() - started
+        if not tick_times:
+            logger.warning("The tapes contained no ticks.")
+            return
+        logger.info(
+            f"Replayed {len(tick_times)} ticks ({markets} markets, {triggered} triggered alerts) in {total:.2f}s. "
+            f"Throughput: {len(tick_times) / total:.1f} ticks/s, {markets / total:.0f} markets/s. "
+            f"Tick time p50: {percentile(tick_times, 0.5) * 1000:.1f}ms, p99: {percentile(tick_times, 0.99) * 1000:.1f}ms."
+        )
+    finally:
+        await mongo_client.close()
+
+def main():
+    load_dotenv()
+    config.setup_logging()
+    parser = argparse.ArgumentParser(description="Replay market data tapes through the collector.")
+    parser.add_argument("tapes", nargs="+", help="Tape files, in the order to replay them.")
+    parser.add_argument("--speed", default="max", help="Replay speed multiplier (e.g. 10), or 'max' for no delay (default).")
+    parser.add_argument("--db-name", default=f"{os.getenv('DB_NAME')}_replay", help="Database to replay into.")
+    parser.add_argument("--alerts-from", help="Database whose active alerts are copied into the replay database first (e.g. the live one).")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    if args.db_name == os.getenv("DB_NAME"):
+        parser.error("Refusing to replay into the live database.")
+    asyncio.run(replay(args.tapes, speed, args.db_name, args.alerts_from))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import mmap
+import os
+import pickle
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the saved state changes shape (2: alert index entries carry last_update).
+SNAPSHOT_VERSION = 2
+
+def normalize_fa(text: str):
+    """Same normalization get_currency_info applies to Persian names: no spaces or ZWNJs, case-insensitive."""
+    return re.sub(r'[\s\u200c]+', '', text).casefold()
+
+class PriceSnapshot:
+    """
+    In-memory copy of the last good `prices` data, with lookup indexes:
+    - markets:      market _id (e.g. "BTCTMN") -> price document (same fields as the `prices` collection)
+    - symbol_index: symbol / English name (casefolded) -> market _id
+    - fa_index:     normalized Persian name -> market _id
+    - alert_index:  alert symbol -> {alert _id: {"user_id", "target_price", "condition", "last_update"}} for active alerts
+
+    It can be saved to and loaded from a compact local file, so after a restart the bot
+    can answer lookups before MongoDB and the first API fetch are ready.
+    """
+    def __init__(self):
+        self.markets = {}
+        self.symbol_index = {}
+        self.fa_index = {}
+        self.alert_index = {}
+        # False until the alert index has been filled from a saved file or from the database.
+        self.alerts_loaded = False
+        # Symbols with new or reactivated alerts, which must be checked even if their price didn't change.
+        self.pending_alert_symbols = set()
+
+    def __bool__(self):
+        return bool(self.markets)
+
+    """---------- Prices ----------"""
+    def set_market(self, market_id, document: dict):
+        self.markets[market_id] = document
+        # setdefault keeps the first market seen for a name, like find_one returning the first match.
+        self.symbol_index.setdefault(document["symbol"].casefold(), market_id)
+        self.symbol_index.setdefault(document["en_base_asset"].casefold(), market_id)
+        self.fa_index.setdefault(normalize_fa(document["fa_symbol"]), market_id)
+
+    def lookup(self, targeted_currency: str):
+        """Finds a currency by symbol, English name or Persian name. Returns a copy of its document (with _id) or None."""
+        market_id = self.symbol_index.get(targeted_currency.strip().casefold())
+        if market_id is None:
+            market_id = self.fa_index.get(normalize_fa(targeted_currency))
+        document = self.markets.get(market_id)
+        return dict(document, _id=market_id) if document else None
+
+    def toman_market(self, document: dict):
+        """Returns the Toman market of a currency if there is one (e.g. "BTCTMN"), otherwise the document's own market."""
+        market_id = f"{document['symbol']}TMN"
+        return market_id if market_id in self.markets else document["_id"]
+
+    def get_price(self, market_id):
+        document = self.markets.get(market_id)
+        return document["price"] if document else None
+
+    """---------- Alerts ----------"""
+    def set_alerts(self, alerts):
+        """Rebuilds the alert index from a list of active alert documents."""
+        self.alert_index = {}
+        for alert in alerts:
+            self.set_alert(alert)
+        self.alerts_loaded = True
+
+    def set_alert(self, alert: dict):
+        self.pending_alert_symbols.add(alert["symbol"])
+        self.alert_index.setdefault(alert["symbol"], {})[alert["_id"]] = {
+            "user_id": alert["user_id"],
+            "target_price": alert["target_price"],
+            "condition": alert["condition"],
+            # Changes whenever the alert is (re)set; part of the alert's notification key.
+            "last_update": alert.get("last_update")
+        }
+
+    def recheck_alerts(self, symbols):
+        """Has the alerts on these symbols checked again on the next tick, even if their prices don't change."""
+        self.pending_alert_symbols.update(symbols)
+
+    def pop_pending_alert_symbols(self):
+        pending, self.pending_alert_symbols = self.pending_alert_symbols, set()
+        return pending
+
+    def remove_alert(self, alert: dict):
+        symbol_alerts = self.alert_index.get(alert["symbol"])
+        if symbol_alerts is not None:
+            symbol_alerts.pop(alert["_id"], None)
+            if not symbol_alerts:
+                del self.alert_index[alert["symbol"]]
+
+    """---------- Persistence ----------"""
+    def dumps(self):
+        """Serializes the snapshot. Cheap enough to run on the event loop; write the bytes with save_bytes()."""
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "markets": self.markets,
+            "symbol_index": self.symbol_index,
+            "fa_index": self.fa_index,
+            "alert_index": self.alert_index if self.alerts_loaded else None
+        }
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def save_bytes(path: str, data: bytes):
+        """Writes the file atomically, so a crash mid-write never leaves a broken snapshot behind."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def save(self, path: str):
+        """Serializes on the event loop (where the data is mutated) and writes the file in a worker thread."""
+        if not self:
+            return
+        data = self.dumps()
+        try:
+            await asyncio.to_thread(self.save_bytes, path, data)
+            logger.info(f"Saved price snapshot ({len(data)} bytes) to {path}.")
+        except OSError as e:
+            logger.error(f"Could not save price snapshot to {path}: {e}")
+
+    def load(self, path: str):
+        """Loads a snapshot file written by save_bytes(). Returns True on success."""
+        started = time.perf_counter()
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                state = pickle.loads(mapped)
+        except FileNotFoundError:
+            logger.info(f"No price snapshot found at {path}. Starting cold.")
+            return False
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Could not load price snapshot from {path}: {e}")
+            return False
+
+        if state.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring price snapshot with unknown version {state.get('version')}.")
+            return False
+
+        self.markets = state["markets"]
+        self.symbol_index = state["symbol_index"]
+        self.fa_index = state["fa_index"]
+        if state["alert_index"] is not None:
+            self.alert_index = state["alert_index"]
+            self.alerts_loaded = True
+        age = time.time() - state["saved_at"]
+        logger.info(
+            f"Loaded price snapshot with {len(self.markets)} markets ({age:.0f}s old) "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms."
+        )
+        return True
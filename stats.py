@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+def today_key():
+    return f"daily:{datetime.now(timezone.utc).date().isoformat()}"
+
+def field_name(name):
+    """Makes a value (e.g. a currency symbol) safe to use as a MongoDB field name."""
+    return str(name).replace(".", "_").replace("$", "_")
+
+class StatsCounters:
+    """
+    Usage counters kept in memory and flushed as $inc updates to the `stats` collection.
+    There are two documents per flush: "totals" and "daily:<date>". Reading them back is two
+    lookups by _id, so dashboards never need to scan the users, alerts or subscriptions collections.
+    """
+    def __init__(self):
+        self.pending = {}  # stats document _id -> Counter(field -> delta)
+
+    def incr(self, field: str, amount: int = 1, daily: bool = False):
+        document_id = today_key() if daily else "totals"
+        self.pending.setdefault(document_id, Counter())[field] += amount
+
+    def record_query(self, symbol):
+        """Counts a currency lookup; symbol is None when nothing was found."""
+        field = f"queries.{field_name(symbol)}" if symbol else "queries_missed"
+        self.incr(field)
+        self.incr(field, daily=True)
+
+    def discard(self, document_id, prefixes):
+        """Drops pending deltas under the given field prefixes (used after recounting them from scratch)."""
+        counter = self.pending.get(document_id)
+        if counter:
+            for field in list(counter):
+                if field.startswith(prefixes):
+                    del counter[field]
+
+    async def flush(self, collection, gauges: dict = None):
+        """Writes the pending deltas (and the current gauge values, with $set) to the stats collection."""
+        pending, self.pending = self.pending, {}
+        now = datetime.now(timezone.utc)
+        gauges = dict(gauges or {})
+        try:
+            for document_id, counter in list(pending.items()):
+                update = {"$set": {"updated_at": now}}
+                increments = {field: delta for field, delta in counter.items() if delta}
+                if increments:
+                    update["$inc"] = increments
+                if document_id == "totals":
+                    update["$set"].update(gauges)
+                    gauges = None
+                await collection.update_one({"_id": document_id}, update, upsert=True)
+                # Written: it must not be put back if a later document fails.
+                del pending[document_id]
+            if gauges:
+                await collection.update_one({"_id": "totals"}, {"$set": {**gauges, "updated_at": now}}, upsert=True)
+        except Exception as e:
+            # Put back the deltas that weren't written, so they go out with the next flush.
+            for document_id, counter in pending.items():
+                self.pending.setdefault(document_id, Counter()).update(counter)
+            logger.error(f"Failed to flush stats: {e}")
+
+    def apply_pending(self, document_id, document: dict):
+        """Adds the not-yet-flushed deltas to a stats document read from the database."""
+        for field, delta in self.pending.get(document_id, {}).items():
+            target = document
+            *parents, leaf = field.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = target.get(leaf, 0) + delta
+        return document
+
+
+class StatsHttpServer:
+    """
+    Minimal HTTP endpoint serving the stats as JSON: GET /stats
+    If a token is configured it must be sent as "Authorization: Bearer <token>" or "?token=<token>".
+    """
+    def __init__(self, db_manager, host: str = "127.0.0.1", port: int = 8080, token: str = None):
+        self.db_manager = db_manager
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Stats endpoint listening on http://{self.host}:{self.port}/stats")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _authorized(self, authorization: str, query_token: str):
+        # Constant-time comparisons, so response timing doesn't reveal the token.
+        expected = self.token.encode("utf-8")
+        return hmac.compare_digest(authorization.encode("utf-8"), b"Bearer " + expected) or \
+            hmac.compare_digest(query_token.encode("utf-8"), expected)
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode("latin-1").split()
+            url = urlsplit(parts[1]) if len(parts) >= 2 else None
+            if not url or parts[0] != "GET" or url.path != "/stats":
+                status, body = "404 Not Found", {"error": "not found"}
+            elif self.token and not self._authorized(headers.get("authorization", ""), parse_qs(url.query).get("token", [""])[0]):
+                status, body = "401 Unauthorized", {"error": "unauthorized"}
+            else:
+                status, body = "200 OK", await self.db_manager.get_stats()
+
+            payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Stats endpoint request failed: {e}")
+        finally:
+            writer.close()
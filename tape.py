@@ -0,0 +1,59 @@
+import asyncio
+import gzip
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+"""
+A tape is a gzip file of raw API responses, one per line: `<unix timestamp>\t<raw JSON>`.
+Every append adds a new gzip member, so the file is append-only and a crash can at most
+lose the line being written. A new file is started every UTC day.
+"""
+
+class TapeWriter:
+    def __init__(self, directory: str = "tapes", prefix: str = "markets"):
+        self.directory = directory
+        self.prefix = prefix
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, timestamp: float):
+        day = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m%d")
+        return os.path.join(self.directory, f"{self.prefix}-{day}.tape.gz")
+
+    async def append(self, raw: bytes, timestamp: float = None):
+        """Records one raw payload. Compression and disk I/O happen in a worker thread."""
+        timestamp = timestamp if timestamp is not None else time.time()
+        # Newlines in JSON can only be whitespace between tokens (inside strings they are escaped),
+        # so removing them keeps the payload valid and one line long.
+        line = f"{timestamp:.3f}\t".encode() + raw.replace(b"\r", b"").replace(b"\n", b"") + b"\n"
+        try:
+            await asyncio.to_thread(self._write, self.path_for(timestamp), line)
+        except OSError as e:
+            logger.error(f"Could not append to market data tape: {e}")
+
+    @staticmethod
+    def _write(path, line):
+        with gzip.open(path, "ab") as f:
+            f.write(line)
+
+
+def read_tape(path: str):
+    """Yields (timestamp, raw payload bytes) for every recorded tick, in order."""
+    with gzip.open(path, "rb") as f:
+        line_number = 0
+        try:
+            for line_number, line in enumerate(f, start=1):
+                line = line.rstrip(b"\n")
+                if not line:
+                    continue
+                try:
+                    timestamp, raw = line.split(b"\t", 1)
+                    yield float(timestamp), raw
+                except ValueError:
+                    logger.warning(f"Skipping malformed line {line_number} in tape {path}.")
+        except EOFError:
+            # The process stopped in the middle of an append; everything before it is intact.
+            logger.warning(f"Tape {path} ends with a truncated record after line {line_number}.")
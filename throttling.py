@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` tokens saved up."""
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst: float):
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, rate: float, burst: float):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ThrottlingUpdateProcessor(BaseUpdateProcessor):
+    """
+    Ingress middleware in front of all handlers (including the ConversationHandler).
+
+    Before any handler runs, every update from a user goes through these cheap checks:
+    - a per-user token bucket (rate limit),
+    - collapsing duplicates: the same text/button from a user that is already being processed is dropped,
+    - a global budget of updates in progress; above it, new updates are shed.
+    Rejected updates get a short "slow down" reply instead of running handlers, and every
+    rejection is counted in `rejections`.
+
+    Updates from the same user are processed one at a time (in order), so conversation
+    state stays consistent while different users are served concurrently.
+    """
+    RATE_LIMITED_MESSAGE = "لطفاً کمی آهسته‌تر! تعداد درخواست‌های شما بیش از حد مجاز است."
+    OVERLOADED_MESSAGE = "ربات در حال حاضر شلوغ است. لطفاً چند لحظه دیگر دوباره تلاش کنید."
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, rate: float = 1.0, burst: float = 5, budget: int = 64, max_concurrent_updates: int = 256,
+                 warning_interval: float = 10.0):
+        super().__init__(max_concurrent_updates)
+        self.rate = rate
+        self.burst = burst
+        self.budget = budget
+        self.warning_interval = warning_interval
+
+        self.buckets = {}          # user_id -> TokenBucket
+        self.user_locks = {}       # user_id -> [asyncio.Lock, number of updates holding or waiting for it]
+        self.in_flight = set()     # (user_id, payload) of updates being processed
+        self.in_flight_count = 0
+        self.last_warned = {}      # user_id -> time of the last "slow down" reply
+        self.rejections = Counter()
+        self.next_prune_at = time.monotonic() + self.PRUNE_INTERVAL
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _payload(update: Update):
+        if update.callback_query:
+            return update.callback_query.data
+        if update.effective_message:
+            return update.effective_message.text
+        return None
+
+    # The checks run in do_process_update, the hook PTB provides for subclasses (process_update is final).
+    # It is called once the base class has taken one of the max_concurrent_updates slots. The budget
+    # is meant to be smaller than that, so the "overloaded" check is still reached.
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+
+        now = time.monotonic()
+        if now >= self.next_prune_at:
+            self.next_prune_at = now + self.PRUNE_INTERVAL
+            self._prune(now)
+
+        key = (user.id, self._payload(update))
+        reason = None
+        if key[1] is not None and key in self.in_flight:
+            reason = "duplicate"
+        elif not self.buckets.setdefault(user.id, TokenBucket(self.burst)).take(self.rate, self.burst):
+            reason = "rate_limited"
+        elif self.in_flight_count >= self.budget:
+            reason = "overloaded"
+
+        if reason:
+            # The handlers never run for this update.
+            coroutine.close()
+            self.rejections[reason] += 1
+            logger.debug(f"Rejected update from user {user.id}: {reason}", extra={"hot_path": True})
+            if reason != "duplicate":
+                await self._warn(update, user.id, reason)
+            return
+
+        self.in_flight.add(key)
+        self.in_flight_count += 1
+        entry = self.user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            self.in_flight.discard(key)
+            self.in_flight_count -= 1
+            entry[1] -= 1
+            # Drop the lock once the user has nothing pending, so the dict doesn't grow forever.
+            if entry[1] == 0:
+                del self.user_locks[user.id]
+
+    def _prune(self, now):
+        """
+        Forgets users whose bucket has refilled completely (a new bucket would be identical) and
+        expired "slow down" timestamps. Runs at most once every PRUNE_INTERVAL seconds.
+        """
+        self.buckets = {
+            user_id: bucket for user_id, bucket in self.buckets.items()
+            if bucket.tokens + (now - bucket.updated_at) * self.rate < self.burst
+        }
+        self.last_warned = {uid: t for uid, t in self.last_warned.items() if now - t < self.warning_interval}
+
+    async def _warn(self, update: Update, user_id, reason):
+        """Sends at most one cheap reply per user every warning_interval seconds."""
+        now = time.monotonic()
+        if now - self.last_warned.get(user_id, 0) < self.warning_interval:
+            return
+        self.last_warned[user_id] = now
+
+        text = self.RATE_LIMITED_MESSAGE if reason == "rate_limited" else self.OVERLOADED_MESSAGE
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(text)
+            elif update.effective_message:
+                await update.effective_message.reply_text(text)
+        except Exception as e:
+            logger.debug(f"Could not send throttling reply to user {user_id}: {e}", extra={"hot_path": True})